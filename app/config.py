@@ -2,8 +2,10 @@ from pydantic_settings import BaseSettings
 from pydantic import ConfigDict
 from functools import lru_cache
 
-# Models allowed through the proxy
-ALLOWED_MODELS = ["llama3.2:1b", "moondream"]
+# Models allowed through the proxy. The tuple keeps a stable order for
+# listings and error messages; the frozenset is for membership checks.
+ALLOWED_MODELS_DISPLAY = ("llama3.2:1b", "moondream")
+ALLOWED_MODELS = frozenset(ALLOWED_MODELS_DISPLAY)
 
 
 class Settings(BaseSettings):
@@ -12,14 +14,20 @@ class Settings(BaseSettings):
     # Server settings
     host: str = "0.0.0.0"
     port: int = 8000
+    reload: bool = False  # restart on code changes (development only)
+    pretty_json: bool = False  # indent JSON responses (readable, but larger and slower)
 
     # Ollama settings
     ollama_base_url: str = "http://localhost:11434"
     ollama_max_concurrent: int = 1
+    # HTTP/2 is only negotiated over TLS (e.g. Ollama behind a reverse proxy)
+    # and needs the h2 package (pip install "httpx[http2]")
+    ollama_http2: bool = False
 
     # Database settings
     database_url: str = "sqlite+aiosqlite:///./db/proxy.db"
     database_path: str = "./db/proxy.db"
+    database_pool_size: int = 20
 
     # Admin settings
     admin_api_key: str = "admin-secret-key"
@@ -1,9 +1,13 @@
 import asyncio
 import logging
 import secrets
+import time
+from datetime import datetime, timedelta, timezone
 
 import aiosqlite
+from collections import OrderedDict
 from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from typing import AsyncGenerator
 
 from .config import get_settings
@@ -16,7 +20,52 @@ RETRY_BASE_DELAY = 0.1  # seconds
 
 # Connection pool
 _pool: asyncio.Queue | None = None
-_pool_size = 20
+
+# Usage writer: schedule_usage() rows are coalesced into batched transactions
+USAGE_BATCH_SIZE = 100
+_usage_queue: asyncio.Queue | None = None
+_usage_writer: asyncio.Task | None = None
+_usage_pending = 0  # rows queued but not yet committed
+_background_writes: set[asyncio.Task] = set()  # strong refs for fallback writes
+
+API_KEY_CACHE_SIZE = 10_000
+API_KEY_CACHE_TTL = 60.0  # seconds
+
+
+# Hot-path SQL, defined once so every call hands sqlite3 the same text and hits
+# its per-connection statement cache instead of re-preparing.
+_SQL_INSERT_USER = "INSERT INTO users (id, api_key) VALUES (?, ?)"
+_SQL_INSERT_RATE_LIMITS = """INSERT INTO rate_limits
+    (user_id, requests_per_minute, requests_per_day,
+     tokens_per_minute, tokens_per_day, total_token_limit)
+    VALUES (?, ?, ?, ?, ?, ?)"""
+_SQL_SELECT_USER_BY_API_KEY = "SELECT id, api_key, created_at FROM users WHERE api_key = ?"
+_RATE_LIMIT_COLUMNS = "requests_per_minute, requests_per_day, tokens_per_minute, tokens_per_day, total_token_limit"
+_SQL_SELECT_RATE_LIMITS = f"SELECT {_RATE_LIMIT_COLUMNS} FROM rate_limits WHERE user_id = ?"
+_SQL_INSERT_USAGE = """INSERT INTO usage
+    (user_id, model, prompt_tokens, completion_tokens, total_tokens, cost, request_id, prompt_preview)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+_SQL_UPSERT_USAGE_ROLLUP = """INSERT INTO usage_rollup (user_id, bucket, requests, tokens)
+    VALUES (?, strftime('%Y-%m-%d %H:00:00', 'now'), ?, ?)
+    ON CONFLICT (user_id, bucket) DO UPDATE SET
+        requests = requests + excluded.requests,
+        tokens = tokens + excluded.tokens"""
+_SQL_UPSERT_PRICING = """INSERT INTO model_pricing (model, input_cost_per_million, output_cost_per_million, updated_at)
+    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(model) DO UPDATE SET
+        input_cost_per_million = excluded.input_cost_per_million,
+        output_cost_per_million = excluded.output_cost_per_million,
+        updated_at = CURRENT_TIMESTAMP"""
+_SQL_INSERT_PRICING_HISTORY = """INSERT INTO pricing_history
+    (model, input_cost_per_million, output_cost_per_million, changed_by)
+    VALUES (?, ?, ?, ?)"""
+
+# UPDATE rate_limits statements, keyed by the tuple of columns being set (at
+# most 31 shapes)
+_update_rate_limits_sql: dict[tuple[str, ...], str] = {}
+
+# Per-connection prepared statement cache size (sqlite3 default is 128)
+CACHED_STATEMENTS = 256
 
 SCHEMA = """
 -- Users table
@@ -47,7 +96,17 @@ CREATE TABLE IF NOT EXISTS rate_limits (
     tokens_per_day INTEGER,
     total_token_limit INTEGER,
     FOREIGN KEY (user_id) REFERENCES users(id)
-);
+) WITHOUT ROWID;
+
+-- Hourly per-user usage aggregates, maintained by the usage writer so windowed
+-- and lifetime totals never have to scan the raw usage rows
+CREATE TABLE IF NOT EXISTS usage_rollup (
+    user_id TEXT NOT NULL,
+    bucket TEXT NOT NULL,  -- 'YYYY-MM-DD HH:00:00' (UTC), same format as usage.timestamp
+    requests INTEGER NOT NULL DEFAULT 0,
+    tokens INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, bucket)
+) WITHOUT ROWID;
 
 -- Model pricing
 CREATE TABLE IF NOT EXISTS model_pricing (
@@ -69,21 +128,109 @@ CREATE TABLE IF NOT EXISTS pricing_history (
 );
 
 -- Indexes for faster queries
-CREATE INDEX IF NOT EXISTS idx_usage_user_id ON usage(user_id);
 CREATE INDEX IF NOT EXISTS idx_usage_timestamp ON usage(timestamp);
-CREATE INDEX IF NOT EXISTS idx_usage_user_timestamp ON usage(user_id, timestamp);
-CREATE INDEX IF NOT EXISTS idx_users_api_key ON users(api_key);
+-- Covers the per-user windowed and lifetime SUM(total_tokens) queries, so they
+-- are answered from the index without touching the table
+CREATE INDEX IF NOT EXISTS idx_usage_user_ts_tokens ON usage(user_id, timestamp, total_tokens);
 CREATE INDEX IF NOT EXISTS idx_pricing_history_model ON pricing_history(model);
 CREATE INDEX IF NOT EXISTS idx_pricing_history_changed_at ON pricing_history(changed_at);
 """
 
 
+@dataclass(frozen=True, slots=True)
+class UserRow:
+    """A row of the users table."""
+    id: str
+    api_key: str
+    created_at: str
+
+
+@dataclass(frozen=True, slots=True)
+class RateLimitsRow:
+    """A user's rate limits. None means the limit is not enforced."""
+    requests_per_minute: int | None
+    requests_per_day: int | None
+    tokens_per_minute: int | None
+    tokens_per_day: int | None
+    total_token_limit: int | None
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after a fixed TTL."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        """Return the cached value, or None if missing or expired."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value) -> None:
+        """Insert a value, evicting the least recently used entry if full."""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        """Remove a key if present."""
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._data.clear()
+
+
+# api_key -> UserRow. Only hits are cached; entries are invalidated when a
+# user is deleted.
+_api_key_cache = TTLCache(maxsize=API_KEY_CACHE_SIZE, ttl=API_KEY_CACHE_TTL)
+
+# Every valid api_key, loaded in init_db and kept in sync by create_user /
+# delete_user / delete_all_users. Unknown keys are rejected without a query.
+# None until loaded, in which case lookups fall through to the DB.
+_api_key_set: set[str] | None = None
+
+# model -> pricing dict. Loaded in init_db and kept in sync by
+# set_model_pricing / delete_model_pricing, so once loaded it is authoritative.
+_pricing_cache: dict[str, dict] = {}
+_pricing_cache_loaded = False
+
+
+# Per-connection PRAGMAs. journal_mode=WAL persists in the database file, the
+# rest must be re-applied on every connection.
+# synchronous=NORMAL is safe under WAL (no corruption, only the last commits can
+# be lost on power failure) and skips the fsync on every commit.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",  # 256 MB
+    "PRAGMA cache_size=-65536",  # 64 MB (negative = KiB)
+)
+
+
+async def _apply_pragmas(db: aiosqlite.Connection) -> None:
+    """Apply performance PRAGMAs to a connection."""
+    for pragma in CONNECTION_PRAGMAS:
+        await db.execute(pragma)
+
+
 async def _create_connection() -> aiosqlite.Connection:
     """Create a new database connection with optimal settings."""
-    db = await aiosqlite.connect(settings.database_path)
+    db = await aiosqlite.connect(settings.database_path, cached_statements=CACHED_STATEMENTS)
     db.row_factory = aiosqlite.Row
-    await db.execute("PRAGMA journal_mode=WAL")
-    await db.execute("PRAGMA busy_timeout=5000")
+    await _apply_pragmas(db)
     return db
 
 
@@ -93,8 +240,7 @@ async def init_db() -> None:
 
     # Create schema with a temporary connection
     async with aiosqlite.connect(settings.database_path) as db:
-        await db.execute("PRAGMA journal_mode=WAL")
-        await db.execute("PRAGMA busy_timeout=5000")
+        await _apply_pragmas(db)
         await db.executescript(SCHEMA)
 
         # Migrations - Add cost column to usage table
@@ -120,20 +266,51 @@ async def init_db() -> None:
         except aiosqlite.OperationalError:
             pass
 
-    # Initialize connection pool
-    _pool = asyncio.Queue(maxsize=_pool_size)
-    for _ in range(_pool_size):
-        conn = await _create_connection()
-        await _pool.put(conn)
+        # Migrations - Backfill usage_rollup for databases created before it existed
+        cursor = await db.execute("SELECT 1 FROM usage_rollup LIMIT 1")
+        if await cursor.fetchone() is None:
+            await db.execute(
+                """INSERT INTO usage_rollup (user_id, bucket, requests, tokens)
+                   SELECT user_id, strftime('%Y-%m-%d %H:00:00', timestamp), COUNT(*), SUM(total_tokens)
+                   FROM usage GROUP BY 1, 2"""
+            )
+            await db.commit()
+
+        # Migrations - Superseded by the covering idx_usage_user_ts_tokens
+        await db.execute("DROP INDEX IF EXISTS idx_usage_user_timestamp")
+        await db.execute("DROP INDEX IF EXISTS idx_usage_user_id")
+        # Migrations - Duplicates the automatic index behind UNIQUE(api_key)
+        await db.execute("DROP INDEX IF EXISTS idx_users_api_key")
+
+        # Refresh planner statistics so the covering index is chosen.
+        # analysis_limit keeps ANALYZE cheap on large usage tables.
+        await db.execute("PRAGMA analysis_limit=400")
+        await db.execute("ANALYZE")
+        await db.commit()
+
+    # Initialize connection pool (connections are opened concurrently)
+    pool_size = settings.database_pool_size
+    _pool = asyncio.Queue(maxsize=pool_size)
+    connections = await asyncio.gather(*(_create_connection() for _ in range(pool_size)))
+    for conn in connections:
+        _pool.put_nowait(conn)
+
+    await _load_pricing_cache()
+    await _load_api_key_set()
 
 
 async def close_db() -> None:
     """Close all connections in the pool."""
     global _pool
     if _pool is not None:
+        optimized = False
         while not _pool.empty():
             try:
                 db = _pool.get_nowait()
+                if not optimized:
+                    # Let SQLite re-analyze tables whose stats have drifted
+                    await db.execute("PRAGMA optimize")
+                    optimized = True
                 await db.close()
             except asyncio.QueueEmpty:
                 break
@@ -181,15 +358,9 @@ async def create_user(user_id: str) -> tuple[str, str]:
     api_key = generate_api_key(user_id)
 
     async with get_db() as db:
+        await db.execute(_SQL_INSERT_USER, (user_id, api_key))
         await db.execute(
-            "INSERT INTO users (id, api_key) VALUES (?, ?)",
-            (user_id, api_key),
-        )
-        await db.execute(
-            """INSERT INTO rate_limits
-               (user_id, requests_per_minute, requests_per_day,
-                tokens_per_minute, tokens_per_day, total_token_limit)
-               VALUES (?, ?, ?, ?, ?, ?)""",
+            _SQL_INSERT_RATE_LIMITS,
             (
                 user_id,
                 settings.default_requests_per_minute,
@@ -201,23 +372,38 @@ async def create_user(user_id: str) -> tuple[str, str]:
         )
         await db.commit()
 
+    if _api_key_set is not None:
+        _api_key_set.add(api_key)
     return user_id, api_key
 
 
-async def get_user_by_api_key(api_key: str) -> dict | None:
-    """Get user by API key."""
+async def _load_api_key_set() -> None:
+    """Load every user's api_key into the negative-lookup set."""
+    global _api_key_set
     async with get_db() as db:
-        cursor = await db.execute(
-            "SELECT id, api_key, created_at FROM users WHERE api_key = ?",
-            (api_key,),
-        )
+        cursor = await db.execute("SELECT api_key FROM users")
+        _api_key_set = {row["api_key"] for row in await cursor.fetchall()}
+
+
+async def get_user_by_api_key(api_key: str) -> UserRow | None:
+    """Get user by API key. Served from an in-memory TTL cache when possible."""
+    user = _api_key_cache.get(api_key)
+    if user is not None:
+        return user
+    if _api_key_set is not None and api_key not in _api_key_set:
+        return None
+
+    async with get_db() as db:
+        cursor = await db.execute(_SQL_SELECT_USER_BY_API_KEY, (api_key,))
         row = await cursor.fetchone()
         if row:
-            return {"id": row["id"], "api_key": row["api_key"], "created_at": row["created_at"]}
+            user = UserRow(*row)
+            _api_key_cache.set(api_key, user)
+            return user
         return None
 
 
-async def get_user_by_id(user_id: str) -> dict | None:
+async def get_user_by_id(user_id: str) -> UserRow | None:
     """Get user by ID."""
     async with get_db() as db:
         cursor = await db.execute(
@@ -226,16 +412,16 @@ async def get_user_by_id(user_id: str) -> dict | None:
         )
         row = await cursor.fetchone()
         if row:
-            return {"id": row["id"], "api_key": row["api_key"], "created_at": row["created_at"]}
+            return UserRow(*row)
         return None
 
 
-async def get_all_users() -> list[dict]:
+async def get_all_users() -> list[UserRow]:
     """Get all users."""
     async with get_db() as db:
         cursor = await db.execute("SELECT id, api_key, created_at FROM users")
         rows = await cursor.fetchall()
-        return [{"id": row["id"], "api_key": row["api_key"], "created_at": row["created_at"]} for row in rows]
+        return [UserRow(*row) for row in rows]
 
 
 async def delete_all_users() -> int:
@@ -245,39 +431,38 @@ async def delete_all_users() -> int:
         row = await cursor.fetchone()
         count = row["count"]
         await db.execute("DELETE FROM usage")
+        await db.execute("DELETE FROM usage_rollup")
         await db.execute("DELETE FROM rate_limits")
         await db.execute("DELETE FROM users")
         await db.commit()
+        _api_key_cache.clear()
+        if _api_key_set is not None:
+            _api_key_set.clear()
         return count
 
 
 async def delete_user(user_id: str) -> bool:
     """Delete a user and their rate limits."""
     async with get_db() as db:
+        cursor = await db.execute("SELECT api_key FROM users WHERE id = ?", (user_id,))
+        row = await cursor.fetchone()
         cursor = await db.execute("DELETE FROM users WHERE id = ?", (user_id,))
         await db.execute("DELETE FROM rate_limits WHERE user_id = ?", (user_id,))
         await db.commit()
+        if row:
+            _api_key_cache.pop(row["api_key"])
+            if _api_key_set is not None:
+                _api_key_set.discard(row["api_key"])
         return cursor.rowcount > 0
 
 
-async def get_rate_limits(user_id: str) -> dict | None:
+async def get_rate_limits(user_id: str) -> RateLimitsRow | None:
     """Get rate limits for a user."""
     async with get_db() as db:
-        cursor = await db.execute(
-            """SELECT requests_per_minute, requests_per_day,
-                      tokens_per_minute, tokens_per_day, total_token_limit
-               FROM rate_limits WHERE user_id = ?""",
-            (user_id,),
-        )
+        cursor = await db.execute(_SQL_SELECT_RATE_LIMITS, (user_id,))
         row = await cursor.fetchone()
         if row:
-            return {
-                "requests_per_minute": row["requests_per_minute"],
-                "requests_per_day": row["requests_per_day"],
-                "tokens_per_minute": row["tokens_per_minute"],
-                "tokens_per_day": row["tokens_per_day"],
-                "total_token_limit": row["total_token_limit"],
-            }
+            return RateLimitsRow(*row)
         return None
 
 
@@ -288,72 +473,201 @@ async def update_rate_limits(
     tokens_per_minute: int | None = None,
     tokens_per_day: int | None = None,
     total_token_limit: int | None = None,
-) -> bool:
-    """Update rate limits for a user."""
+) -> RateLimitsRow | None:
+    """
+    Update rate limits for a user. Only fields that are not None are changed.
+
+    Returns the updated limits, or None if nothing was updated.
+    """
+    fields = {
+        name: value
+        for name, value in (
+            ("requests_per_minute", requests_per_minute),
+            ("requests_per_day", requests_per_day),
+            ("tokens_per_minute", tokens_per_minute),
+            ("tokens_per_day", tokens_per_day),
+            ("total_token_limit", total_token_limit),
+        )
+        if value is not None
+    }
+    if not fields:
+        return None
+
+    # Field names are always in the order above, so the tuple identifies the shape
+    shape = tuple(fields)
+    query = _update_rate_limits_sql.get(shape)
+    if query is None:
+        assignments = ", ".join(f"{name} = ?" for name in shape)
+        query = f"UPDATE rate_limits SET {assignments} WHERE user_id = ?"
+        _update_rate_limits_sql[shape] = query
+
+    # UPDATE then SELECT on the same connection rather than UPDATE ... RETURNING,
+    # which needs SQLite 3.35+ (older distros such as Ubuntu 20.04 ship 3.31)
     async with get_db() as db:
-        # Build update query dynamically
-        updates = []
-        params = []
-
-        if requests_per_minute is not None:
-            updates.append("requests_per_minute = ?")
-            params.append(requests_per_minute)
-        if requests_per_day is not None:
-            updates.append("requests_per_day = ?")
-            params.append(requests_per_day)
-        if tokens_per_minute is not None:
-            updates.append("tokens_per_minute = ?")
-            params.append(tokens_per_minute)
-        if tokens_per_day is not None:
-            updates.append("tokens_per_day = ?")
-            params.append(tokens_per_day)
-        if total_token_limit is not None:
-            updates.append("total_token_limit = ?")
-            params.append(total_token_limit)
-
-        if not updates:
-            return False
-
-        params.append(user_id)
-        query = f"UPDATE rate_limits SET {', '.join(updates)} WHERE user_id = ?"
-
-        cursor = await db.execute(query, params)
+        cursor = await db.execute(query, (*fields.values(), user_id))
+        row = None
+        if cursor.rowcount:
+            cursor = await db.execute(_SQL_SELECT_RATE_LIMITS, (user_id,))
+            row = await cursor.fetchone()
         await db.commit()
-        return cursor.rowcount > 0
+        return RateLimitsRow(*row) if row else None
 
 
-async def record_usage(
-    user_id: str,
-    model: str,
-    prompt_tokens: int,
-    completion_tokens: int,
-    total_tokens: int,
-    cost: float = 0.0,
-    request_id: str | None = None,
-    prompt_preview: str | None = None,
-) -> None:
-    """Record token usage for a request. Retries on database lock."""
+async def _write_usage_batch(rows: list[tuple]) -> None:
+    """
+    Insert usage rows and update the hourly rollup in a single transaction.
+
+    Retries on database lock.
+    """
+    # Collapse the batch to one rollup upsert per user
+    rollup: dict[str, list[int]] = {}
+    for row in rows:
+        totals = rollup.setdefault(row[0], [0, 0])
+        totals[0] += 1
+        totals[1] += row[4]
+    rollup_rows = [(user_id, requests, tokens) for user_id, (requests, tokens) in rollup.items()]
+
     for attempt in range(MAX_WRITE_RETRIES):
         try:
             async with get_db() as db:
-                await db.execute(
-                    """INSERT INTO usage (user_id, model, prompt_tokens, completion_tokens, total_tokens, cost, request_id, prompt_preview)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (user_id, model, prompt_tokens, completion_tokens, total_tokens, cost, request_id, prompt_preview),
-                )
+                await db.executemany(_SQL_INSERT_USAGE, rows)
+                await db.executemany(_SQL_UPSERT_USAGE_ROLLUP, rollup_rows)
                 await db.commit()
                 return
         except aiosqlite.OperationalError as e:
             if "database is locked" in str(e) and attempt < MAX_WRITE_RETRIES - 1:
                 delay = RETRY_BASE_DELAY * (2 ** attempt)
-                logger.warning(f"Database locked on record_usage, retrying in {delay:.1f}s (attempt {attempt + 1}/{MAX_WRITE_RETRIES})")
+                logger.warning(f"Database locked on usage write, retrying in {delay:.1f}s (attempt {attempt + 1}/{MAX_WRITE_RETRIES})")
                 await asyncio.sleep(delay)
             else:
                 raise
 
 
+async def _usage_writer_loop() -> None:
+    """
+    Drain the usage queue, committing everything queued so far in one transaction.
+
+    Queue items are (row, future) pairs; either may be None. A None row is a
+    flush barrier and a None future is a fire-and-forget write. Rows that
+    arrive while a batch is being committed form the next batch, so under load
+    many writes share a single commit. A bare None item stops the loop after
+    the current batch is written.
+    """
+    global _usage_pending
+    stopping = False
+    while not stopping:
+        rows = []
+        futures = []
+        item = await _usage_queue.get()
+        while True:
+            if item is None:
+                stopping = True
+            else:
+                row, future = item
+                if row is not None:
+                    rows.append(row)
+                if future is not None:
+                    futures.append(future)
+            if stopping or len(rows) >= USAGE_BATCH_SIZE:
+                break
+            try:
+                item = _usage_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+
+        error = None
+        if rows:
+            try:
+                await _write_usage_batch(rows)
+            except Exception as e:
+                logger.exception("Failed to write usage batch")
+                error = e
+            finally:
+                _usage_pending -= len(rows)
+
+        for future in futures:
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+
+async def start_usage_writer() -> None:
+    """Start the background task that batches usage inserts."""
+    global _usage_queue, _usage_writer, _usage_pending
+    if _usage_writer is not None:
+        return
+    _usage_queue = asyncio.Queue()
+    _usage_pending = 0
+    _usage_writer = asyncio.create_task(_usage_writer_loop())
+
+
+async def stop_usage_writer() -> None:
+    """Flush pending usage rows and stop the background writer."""
+    global _usage_queue, _usage_writer
+    if _usage_writer is None:
+        return
+    _usage_queue.put_nowait(None)
+    await _usage_writer
+    _usage_queue = None
+    _usage_writer = None
+
+
+async def flush_usage() -> None:
+    """Wait until every usage row queued so far has been committed."""
+    if _usage_writer is None or _usage_pending == 0:
+        return
+    future = asyncio.get_running_loop().create_future()
+    _usage_queue.put_nowait((None, future))
+    try:
+        await future
+    except Exception:
+        # The failed batch was already logged by the writer; reads proceed
+        pass
+
+
+def _log_usage_write_error(task: asyncio.Task) -> None:
+    """Done-callback for direct fire-and-forget usage writes."""
+    _background_writes.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Failed to record usage", exc_info=task.exception())
+
+
+def schedule_usage(
+    user_id: str,
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    total_tokens: int,
+    cost: float = 0.0,
+    request_id: str | None = None,
+    prompt_preview: str | None = None,
+) -> None:
+    """
+    Record token usage without waiting for the write to commit.
+
+    The row is handed to the usage writer (or, if it isn't running, to a
+    background task), so the DB commit stays off the request's critical path.
+    Reads that report usage call flush_usage() first, so they still see it.
+    """
+    global _usage_pending
+    row = (user_id, model, prompt_tokens, completion_tokens, total_tokens, cost, request_id, prompt_preview)
+
+    if _usage_writer is None:
+        task = asyncio.get_running_loop().create_task(_write_usage_batch([row]))
+        _background_writes.add(task)
+        task.add_done_callback(_log_usage_write_error)
+        return
+
+    _usage_pending += 1
+    _usage_queue.put_nowait((row, None))
+
+
 async def get_usage_stats(user_id: str) -> dict:
     """Get usage statistics for a user."""
+    await flush_usage()
     async with get_db() as db:
         # Total usage
         cursor = await db.execute(
@@ -400,43 +714,68 @@ async def get_usage_stats(user_id: str) -> dict:
         return {**total_stats, "by_model": by_model}
 
 
-async def get_requests_in_window(user_id: str, window_seconds: int) -> int:
-    """Get number of requests in the last N seconds."""
+def _window_start_bucket(window_seconds: int) -> str:
+    """
+    Return the usage_rollup bucket containing the start of the last N seconds.
+
+    Computed in Python so the query compares against a bound parameter, which
+    SQLite can use directly as the range start on the primary key.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=window_seconds)
+    return cutoff.strftime("%Y-%m-%d %H:00:00")
+
+
+async def get_usage_timeline(user_id: str, window_seconds: int) -> list[tuple[float, int, int]]:
+    """
+    Get hourly (bucket end unix timestamp, requests, tokens) for the last N seconds, oldest first.
+
+    Buckets are stamped with their end time so that usage near the start of
+    the window ages out late rather than early.
+    """
+    await flush_usage()
     async with get_db() as db:
         cursor = await db.execute(
-            """SELECT COUNT(*) as count FROM usage
-               WHERE user_id = ? AND timestamp > datetime('now', ?)""",
-            (user_id, f"-{window_seconds} seconds"),
+            """SELECT CAST(strftime('%s', bucket) AS INTEGER) + 3600 as ts, requests, tokens FROM usage_rollup
+               WHERE user_id = ? AND bucket >= ?
+               ORDER BY bucket""",
+            (user_id, _window_start_bucket(window_seconds)),
         )
-        row = await cursor.fetchone()
-        return row["count"]
+        rows = await cursor.fetchall()
+        return [(float(row["ts"]), row["requests"], row["tokens"]) for row in rows]
 
 
-async def get_tokens_in_window(user_id: str, window_seconds: int) -> int:
-    """Get total tokens used in the last N seconds."""
+async def get_total_tokens(user_id: str) -> int:
+    """Get total tokens ever used by a user."""
+    await flush_usage()
     async with get_db() as db:
         cursor = await db.execute(
-            """SELECT COALESCE(SUM(total_tokens), 0) as total FROM usage
-               WHERE user_id = ? AND timestamp > datetime('now', ?)""",
-            (user_id, f"-{window_seconds} seconds"),
+            "SELECT COALESCE(SUM(tokens), 0) as total FROM usage_rollup WHERE user_id = ?",
+            (user_id,),
         )
         row = await cursor.fetchone()
         return row["total"]
 
 
-async def get_total_tokens(user_id: str) -> int:
-    """Get total tokens ever used by a user."""
+async def get_request_history_version(user_id: str) -> tuple[int, int]:
+    """
+    Get (latest usage id, row count) for a user's request history.
+
+    Usage rows are only ever appended (ids are AUTOINCREMENT, never reused)
+    or deleted, so the pair changes whenever the history does.
+    """
+    await flush_usage()
     async with get_db() as db:
         cursor = await db.execute(
-            "SELECT COALESCE(SUM(total_tokens), 0) as total FROM usage WHERE user_id = ?",
+            "SELECT COALESCE(MAX(id), 0), COUNT(*) FROM usage WHERE user_id = ?",
             (user_id,),
         )
         row = await cursor.fetchone()
-        return row["total"]
+        return row[0], row[1]
 
 
 async def get_request_history(user_id: str, limit: int = 20, offset: int = 0) -> dict:
     """Get paginated request history for a user, newest first."""
+    await flush_usage()
     async with get_db() as db:
         # Get total count
         cursor = await db.execute(
@@ -451,7 +790,7 @@ async def get_request_history(user_id: str, limit: int = 20, offset: int = 0) ->
             """SELECT id, model, prompt_tokens, completion_tokens, total_tokens,
                       cost, timestamp, prompt_preview
                FROM usage WHERE user_id = ?
-               ORDER BY timestamp DESC
+               ORDER BY timestamp DESC, id DESC
                LIMIT ? OFFSET ?""",
             (user_id, limit, offset),
         )
@@ -490,44 +829,57 @@ async def set_model_pricing(
     async with get_db() as db:
         # Upsert pricing
         await db.execute(
-            """INSERT INTO model_pricing (model, input_cost_per_million, output_cost_per_million, updated_at)
-               VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-               ON CONFLICT(model) DO UPDATE SET
-                   input_cost_per_million = excluded.input_cost_per_million,
-                   output_cost_per_million = excluded.output_cost_per_million,
-                   updated_at = CURRENT_TIMESTAMP""",
+            _SQL_UPSERT_PRICING,
             (model, input_cost_per_million, output_cost_per_million),
         )
 
         # Log to pricing history
         await db.execute(
-            """INSERT INTO pricing_history (model, input_cost_per_million, output_cost_per_million, changed_by)
-               VALUES (?, ?, ?, ?)""",
+            _SQL_INSERT_PRICING_HISTORY,
             (model, input_cost_per_million, output_cost_per_million, changed_by),
         )
 
         await db.commit()
 
+        _pricing_cache[model] = await _fetch_model_pricing(db, model)
+
+
+async def _fetch_model_pricing(db: aiosqlite.Connection, model: str) -> dict | None:
+    """Read a single model_pricing row."""
+    cursor = await db.execute(
+        """SELECT model, input_cost_per_million, output_cost_per_million,
+                  created_at, updated_at
+           FROM model_pricing WHERE model = ?""",
+        (model,),
+    )
+    row = await cursor.fetchone()
+    if row:
+        return {
+            "model": row["model"],
+            "input_cost_per_million": row["input_cost_per_million"],
+            "output_cost_per_million": row["output_cost_per_million"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+    return None
+
+
+async def _load_pricing_cache() -> None:
+    """Load all model pricing into the in-memory cache."""
+    global _pricing_cache_loaded
+    _pricing_cache.clear()
+    for pricing in await get_all_model_pricing():
+        _pricing_cache[pricing["model"]] = pricing
+    _pricing_cache_loaded = True
+
 
 async def get_model_pricing(model: str) -> dict | None:
     """Get pricing for a specific model."""
+    if _pricing_cache_loaded:
+        return _pricing_cache.get(model)
+
     async with get_db() as db:
-        cursor = await db.execute(
-            """SELECT model, input_cost_per_million, output_cost_per_million,
-                      created_at, updated_at
-               FROM model_pricing WHERE model = ?""",
-            (model,),
-        )
-        row = await cursor.fetchone()
-        if row:
-            return {
-                "model": row["model"],
-                "input_cost_per_million": row["input_cost_per_million"],
-                "output_cost_per_million": row["output_cost_per_million"],
-                "created_at": row["created_at"],
-                "updated_at": row["updated_at"],
-            }
-        return None
+        return await _fetch_model_pricing(db, model)
 
 
 async def get_all_model_pricing() -> list[dict]:
@@ -557,6 +909,7 @@ async def delete_model_pricing(model: str) -> bool:
     async with get_db() as db:
         cursor = await db.execute("DELETE FROM model_pricing WHERE model = ?", (model,))
         await db.commit()
+        _pricing_cache.pop(model, None)
         return cursor.rowcount > 0
 
 
@@ -593,9 +946,9 @@ async def get_pricing_history(model: str | None = None) -> list[dict]:
         ]
 
 
-async def calculate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
-    """Calculate cost for a request based on model pricing."""
-    pricing = await get_model_pricing(model)
+def calculate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Calculate cost for a request based on the cached model pricing."""
+    pricing = _pricing_cache.get(model)
     if not pricing:
         return 0.0
 
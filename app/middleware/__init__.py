@@ -1,4 +1,6 @@
-from .auth import AuthMiddleware, get_current_user
+from .auth import get_current_user
+from .compression import CompressionMiddleware
+from .proxy import ProxyMiddleware
 from .rate_limit import RateLimiter, check_rate_limit
 
-__all__ = ["AuthMiddleware", "get_current_user", "RateLimiter", "check_rate_limit"]
+__all__ = ["CompressionMiddleware", "ProxyMiddleware", "get_current_user", "RateLimiter", "check_rate_limit"]
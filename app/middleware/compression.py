@@ -0,0 +1,21 @@
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import Receive, Scope, Send
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    GZip for JSON responses, except chat completions.
+
+    Completions may be server-sent event streams, which gzip would buffer and
+    deliver late, so the whole /v1/chat/ prefix passes through uncompressed.
+    The savings are on list endpoints such as /admin/users and
+    /v1/usage/history.
+    """
+
+    SKIP_PREFIX = "/v1/chat/"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].startswith(self.SKIP_PREFIX):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
@@ -0,0 +1,116 @@
+import itertools
+import os
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..database import get_user_by_api_key
+
+_BEARER = "Bearer "
+_BEARER_LEN = len(_BEARER)
+
+# Prebuilt 401 responses (sent as-is; nothing downstream mutates them)
+_MISSING_HEADER_RESPONSE = JSONResponse(
+    status_code=401,
+    content={"detail": "Missing Authorization header"},
+    headers={"WWW-Authenticate": "Bearer"},
+)
+_INVALID_FORMAT_RESPONSE = JSONResponse(
+    status_code=401,
+    content={"detail": "Invalid Authorization header format. Use 'Bearer <api_key>'"},
+    headers={"WWW-Authenticate": "Bearer"},
+)
+_INVALID_KEY_RESPONSE = JSONResponse(
+    status_code=401,
+    content={"detail": "Invalid API key"},
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+
+class ProxyMiddleware:
+    """
+    Request ID and API key authentication in a single ASGI middleware.
+
+    Each request (other than health probes and static files, which pass
+    straight through) gets an X-Request-Id (taken from the client header, or
+    generated as "<pid>-<counter>" in hex) stored in scope["state"] and echoed
+    on the response. Non-public paths then need a valid "Authorization: Bearer <key>"
+    header; the matching user is stored in scope["state"]["user"].
+
+    Both jobs read the same header list, so doing them in one layer scans the
+    headers once and saves a middleware hop per request.
+    """
+
+    # Paths that don't require authentication
+    PUBLIC_PATHS = frozenset({"/", "/health", "/docs", "/openapi.json", "/redoc", "/favicon.ico"})
+
+    # Static files skip auth; the admin router enforces verify_admin_key itself
+    SKIP_PREFIXES = ("/static", "/admin")
+
+    # Health probes and static assets bypass the middleware entirely (no
+    # request ID either): they are the hottest paths and never touch the DB
+    PASSTHROUGH_PATHS = frozenset({"/", "/health"})
+    PASSTHROUGH_PREFIX = "/static/"
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        # IDs only need to be unique within the service: the pid separates
+        # worker processes and the counter separates requests within one,
+        # without a urandom read per request like uuid4
+        self._request_id_prefix = f"{os.getpid():x}-"
+        self._request_ids = itertools.count()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        if path in self.PASSTHROUGH_PATHS or path.startswith(self.PASSTHROUGH_PREFIX):
+            await self.app(scope, receive, send)
+            return
+
+        # Single pass over the headers for both the request ID and the API key
+        request_id = None
+        auth_header = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                auth_header = value.decode("latin-1")
+            elif name == b"x-request-id":
+                request_id = value.decode("latin-1")
+        if not request_id:
+            request_id = f"{self._request_id_prefix}{next(self._request_ids):x}"
+
+        # Store request_id in request state for use in endpoints
+        state = scope.setdefault("state", {})
+        state["request_id"] = request_id
+        header = (b"x-request-id", request_id.encode("latin-1"))
+
+        async def send_with_request_id(message: Message) -> None:
+            # Add request ID to response headers (new list; never mutate a shared one)
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), header]
+            await send(message)
+
+        # Skip auth for public, static and admin paths
+        if path in self.PUBLIC_PATHS or path.startswith(self.SKIP_PREFIXES):
+            await self.app(scope, receive, send_with_request_id)
+            return
+
+        if not auth_header:
+            await _MISSING_HEADER_RESPONSE(scope, receive, send_with_request_id)
+            return
+
+        if auth_header[:_BEARER_LEN] != _BEARER:
+            await _INVALID_FORMAT_RESPONSE(scope, receive, send_with_request_id)
+            return
+
+        # Validate API key
+        user = await get_user_by_api_key(auth_header[_BEARER_LEN:])
+        if not user:
+            await _INVALID_KEY_RESPONSE(scope, receive, send_with_request_id)
+            return
+
+        # Store user info in request state for later use
+        state["user"] = user
+
+        await self.app(scope, receive, send_with_request_id)
@@ -1,161 +1,290 @@
+import asyncio
+import itertools
 import time
-from collections import defaultdict
+import weakref
+from collections import deque
 from dataclasses import dataclass, field
 from fastapi import HTTPException, Request
 
 from ..database import (
     get_rate_limits,
-    get_requests_in_window,
-    get_tokens_in_window,
     get_total_tokens,
+    get_usage_timeline,
 )
 
+DAY_SECONDS = 86400
+
 
 @dataclass
 class WindowCounter:
-    """Sliding window counter for rate limiting."""
-    timestamps: list[float] = field(default_factory=list)
-    token_counts: list[tuple[float, int]] = field(default_factory=list)
+    """
+    Sliding window counter for rate limiting.
+
+    Keeps per-minute and per-day windows plus a lifetime token total, so rate
+    limit checks never have to query the DB once the counter is hydrated.
+    Entries are appended in time order, so expired ones are popped from the
+    left and token windows keep a running sum instead of re-summing.
+
+    The per-minute request window counts every admitted attempt, so it
+    throttles bursts even when they fail upstream. The daily request window
+    counts only completed requests that recorded usage, the same rows the
+    usage_rollup table counts, so hydrating after a restart reproduces it.
+
+    generation identifies this counter instance; usage recorded against an
+    older generation (a request admitted before a reset) is ignored.
+    """
+    generation: int = 0
+    timestamps: deque[float] = field(default_factory=deque)
+    token_counts: deque[tuple[float, int]] = field(default_factory=deque)
+    daily_requests: deque[float] = field(default_factory=deque)
+    daily_tokens: deque[tuple[float, int]] = field(default_factory=deque)
+    total_tokens: int = 0
+    hydrated: bool = False
+    _token_sum: int = 0
+    _daily_token_sum: int = 0
+
+    def hydrate(self, history: list[tuple[float, int, int]], total_tokens: int) -> None:
+        """
+        Seed the daily and lifetime counters from persisted usage.
 
-    def add_request(self, tokens: int = 0) -> None:
-        """Record a new request."""
+        history holds hourly (bucket end timestamp, requests, tokens) rollups,
+        oldest first. Each bucket's usage is placed at its end time (capped at
+        now), so persisted usage may count against the daily window for up to
+        an hour longer than it strictly should, but never less.
+        """
+        now = time.time()
+        requests: list[float] = []
+        tokens: list[tuple[float, int]] = []
+        for ts, bucket_requests, bucket_tokens in history:
+            ts = min(ts, now)
+            requests.extend([ts] * bucket_requests)
+            if bucket_tokens > 0:
+                tokens.append((ts, bucket_tokens))
+                self._daily_token_sum += bucket_tokens
+        # Prepend so entries recorded since startup stay in timestamp order
+        self.daily_requests.extendleft(reversed(requests))
+        self.daily_tokens.extendleft(reversed(tokens))
+        self.total_tokens += total_tokens
+        self.hydrated = True
+
+    def add_request(self) -> None:
+        """Record an admitted request in the per-minute window."""
+        self.timestamps.append(time.time())
+
+    def add_usage(self, tokens: int) -> None:
+        """Record a completed request and the tokens it consumed."""
         now = time.time()
-        self.timestamps.append(now)
+        self.daily_requests.append(now)
         if tokens > 0:
             self.token_counts.append((now, tokens))
+            self._token_sum += tokens
+            self.daily_tokens.append((now, tokens))
+            self._daily_token_sum += tokens
+            self.total_tokens += tokens
 
     def get_request_count(self, window_seconds: int) -> int:
         """Get number of requests in the last N seconds."""
-        now = time.time()
-        cutoff = now - window_seconds
-        # Clean old entries
-        self.timestamps = [ts for ts in self.timestamps if ts > cutoff]
-        return len(self.timestamps)
+        cutoff = time.time() - window_seconds
+        timestamps = self.timestamps
+        while timestamps and timestamps[0] <= cutoff:
+            timestamps.popleft()
+        return len(timestamps)
 
     def get_token_count(self, window_seconds: int) -> int:
         """Get total tokens in the last N seconds."""
-        now = time.time()
-        cutoff = now - window_seconds
-        # Clean old entries
-        self.token_counts = [(ts, tokens) for ts, tokens in self.token_counts if ts > cutoff]
-        return sum(tokens for _, tokens in self.token_counts)
+        cutoff = time.time() - window_seconds
+        token_counts = self.token_counts
+        while token_counts and token_counts[0][0] <= cutoff:
+            self._token_sum -= token_counts.popleft()[1]
+        return self._token_sum
+
+    def get_daily_request_count(self) -> int:
+        """Get number of requests in the last 24 hours."""
+        cutoff = time.time() - DAY_SECONDS
+        daily_requests = self.daily_requests
+        while daily_requests and daily_requests[0] <= cutoff:
+            daily_requests.popleft()
+        return len(daily_requests)
+
+    def get_daily_token_count(self) -> int:
+        """Get total tokens in the last 24 hours."""
+        cutoff = time.time() - DAY_SECONDS
+        daily_tokens = self.daily_tokens
+        while daily_tokens and daily_tokens[0][0] <= cutoff:
+            self._daily_token_sum -= daily_tokens.popleft()[1]
+        return self._daily_token_sum
 
 
 class RateLimiter:
     """
     Sliding window rate limiter.
 
-    Uses in-memory counters for fast checks with DB fallback for accuracy.
+    All checks are served from in-memory counters. Daily and lifetime counters
+    are hydrated from the DB the first time a user is seen after startup.
     """
 
     def __init__(self):
         # In-memory counters per user
-        self._counters: dict[str, WindowCounter] = defaultdict(WindowCounter)
+        self._counters: dict[str, WindowCounter] = {}
+        # Every new counter gets a fresh generation, so a reset invalidates
+        # the generations handed to requests that are still in flight
+        self._generations = itertools.count(1)
+        # Per-user locks make check-then-record atomic while different users
+        # proceed in parallel. Weak values drop locks nobody is holding.
+        self._locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
 
     def _get_counter(self, user_id: str) -> WindowCounter:
         """Get or create a counter for a user."""
-        return self._counters[user_id]
+        counter = self._counters.get(user_id)
+        if counter is None:
+            counter = WindowCounter(generation=next(self._generations))
+            self._counters[user_id] = counter
+        return counter
 
-    async def check_rate_limit(self, user_id: str) -> None:
+    async def _get_hydrated_counter(self, user_id: str) -> WindowCounter:
+        """
+        Get a user's counter, loading daily and lifetime usage from the DB on first use.
+
+        Must be called with the user's lock held so hydration happens once.
+        """
+        counter = self._get_counter(user_id)
+        if not counter.hydrated:
+            history, total_tokens = await asyncio.gather(
+                get_usage_timeline(user_id, DAY_SECONDS),
+                get_total_tokens(user_id),
+            )
+            counter.hydrate(history, total_tokens)
+        return counter
+
+    def _get_lock(self, user_id: str) -> asyncio.Lock:
+        """Get or create the lock guarding a user's counter."""
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[user_id] = lock
+        return lock
+
+    def reset(self, user_id: str | None = None) -> None:
+        """Forget in-memory state for one user, or for all users."""
+        if user_id is None:
+            self._counters.clear()
+        else:
+            self._counters.pop(user_id, None)
+
+    async def check_rate_limit(self, user_id: str) -> int:
         """
         Check if a request is allowed under rate limits.
 
-        Raises HTTPException with 429 status if rate limit exceeded.
+        Returns the counter generation to pass to record_usage once the
+        request completes. Raises HTTPException with 429 status if rate
+        limit exceeded.
         """
+        async with self._get_lock(user_id):
+            return await self._check_and_record(user_id)
+
+    async def _check_and_record(self, user_id: str) -> int:
+        """Run all limit checks and record the request. Caller holds the user's lock."""
+        # Hydrate before anything else so tokens recorded for this request
+        # are never double-counted by a later hydration
+        counter = await self._get_hydrated_counter(user_id)
+
         limits = await get_rate_limits(user_id)
         if not limits:
-            return  # No limits configured
-
-        counter = self._get_counter(user_id)
+            return counter.generation  # No limits configured
 
         # Check requests per minute
-        if limits["requests_per_minute"]:
+        if limits.requests_per_minute:
             requests_per_minute = counter.get_request_count(60)
-            if requests_per_minute >= limits["requests_per_minute"]:
+            if requests_per_minute >= limits.requests_per_minute:
                 raise HTTPException(
                     status_code=429,
                     detail={
                         "error": "rate_limit_exceeded",
-                        "message": f"Rate limit exceeded: {limits['requests_per_minute']} requests per minute",
+                        "message": f"Rate limit exceeded: {limits.requests_per_minute} requests per minute",
                         "retry_after": 60,
                     },
                     headers={"Retry-After": "60"},
                 )
 
         # Check requests per day
-        if limits["requests_per_day"]:
-            requests_per_day = await get_requests_in_window(user_id, 86400)
-            if requests_per_day >= limits["requests_per_day"]:
+        if limits.requests_per_day:
+            requests_per_day = counter.get_daily_request_count()
+            if requests_per_day >= limits.requests_per_day:
                 raise HTTPException(
                     status_code=429,
                     detail={
                         "error": "rate_limit_exceeded",
-                        "message": f"Rate limit exceeded: {limits['requests_per_day']} requests per day",
+                        "message": f"Rate limit exceeded: {limits.requests_per_day} requests per day",
                         "retry_after": 3600,
                     },
                     headers={"Retry-After": "3600"},
                 )
 
         # Check tokens per minute
-        if limits["tokens_per_minute"]:
+        if limits.tokens_per_minute:
             tokens_per_minute = counter.get_token_count(60)
-            if tokens_per_minute >= limits["tokens_per_minute"]:
+            if tokens_per_minute >= limits.tokens_per_minute:
                 raise HTTPException(
                     status_code=429,
                     detail={
                         "error": "rate_limit_exceeded",
-                        "message": f"Rate limit exceeded: {limits['tokens_per_minute']} tokens per minute",
+                        "message": f"Rate limit exceeded: {limits.tokens_per_minute} tokens per minute",
                         "retry_after": 60,
                     },
                     headers={"Retry-After": "60"},
                 )
 
         # Check tokens per day
-        if limits["tokens_per_day"]:
-            tokens_per_day = await get_tokens_in_window(user_id, 86400)
-            if tokens_per_day >= limits["tokens_per_day"]:
+        if limits.tokens_per_day:
+            tokens_per_day = counter.get_daily_token_count()
+            if tokens_per_day >= limits.tokens_per_day:
                 raise HTTPException(
                     status_code=429,
                     detail={
                         "error": "rate_limit_exceeded",
-                        "message": f"Rate limit exceeded: {limits['tokens_per_day']} tokens per day",
+                        "message": f"Rate limit exceeded: {limits.tokens_per_day} tokens per day",
                         "retry_after": 3600,
                     },
                     headers={"Retry-After": "3600"},
                 )
 
         # Check total token limit
-        if limits["total_token_limit"]:
-            total_tokens = await get_total_tokens(user_id)
-            if total_tokens >= limits["total_token_limit"]:
+        if limits.total_token_limit:
+            if counter.total_tokens >= limits.total_token_limit:
                 raise HTTPException(
                     status_code=429,
                     detail={
                         "error": "rate_limit_exceeded",
-                        "message": f"Total token limit exceeded: {limits['total_token_limit']} tokens",
+                        "message": f"Total token limit exceeded: {limits.total_token_limit} tokens",
                         "retry_after": None,
                     },
                 )
 
         # Record the request attempt
         counter.add_request()
+        return counter.generation
 
-    def record_tokens(self, user_id: str, tokens: int) -> None:
-        """Record token usage for rate limiting."""
-        counter = self._get_counter(user_id)
-        # Add to token counts (timestamp already recorded by add_request)
-        now = time.time()
-        counter.token_counts.append((now, tokens))
+    def record_usage(self, user_id: str, tokens: int, generation: int | None) -> None:
+        """
+        Record a completed request and its tokens for rate limiting.
+
+        Call this wherever a usage row is recorded, with the generation
+        check_rate_limit returned. If the user's counter was reset since, the
+        usage is dropped: the new counter hydrates it from the DB instead.
+        """
+        counter = self._counters.get(user_id)
+        if counter is not None and counter.generation == generation:
+            counter.add_usage(tokens)
 
 
 # Dependency for routes
-async def check_rate_limit(request: Request) -> None:
-    """FastAPI dependency to check rate limits."""
+async def check_rate_limit(request: Request) -> int | None:
+    """FastAPI dependency to check rate limits. Returns the counter generation."""
     if not hasattr(request.state, "user") or not request.state.user:
-        return  # Auth middleware will handle this
+        return None  # Auth middleware will handle this
 
-    user_id = request.state.user["id"]
-    await rate_limiter.check_rate_limit(user_id)
+    user_id = request.state.user.id
+    return await rate_limiter.check_rate_limit(user_id)
 
 
 # Singleton instance
@@ -7,6 +7,7 @@ from .schemas import (
     UserResponse,
     RateLimitUpdate,
     UsageResponse,
+    UserUsageResponse,
     UsageSummary,
     ModelPricingCreate,
     ModelPricingResponse,
@@ -24,6 +25,7 @@ __all__ = [
     "UserResponse",
     "RateLimitUpdate",
     "UsageResponse",
+    "UserUsageResponse",
     "UsageSummary",
     "ModelPricingCreate",
     "ModelPricingResponse",
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Literal
+from typing import Annotated, Literal
 from datetime import datetime
 
 
@@ -8,10 +8,18 @@ class ImageUrl(BaseModel):
     url: str
 
 
-class ContentPart(BaseModel):
-    type: Literal["text", "image_url"]
-    text: str | None = None
-    image_url: ImageUrl | None = None
+class TextPart(BaseModel):
+    type: Literal["text"]
+    text: str
+
+
+class ImageUrlPart(BaseModel):
+    type: Literal["image_url"]
+    image_url: ImageUrl
+
+
+# Tagged on "type" so validation dispatches straight to the matching part model
+ContentPart = Annotated[TextPart | ImageUrlPart, Field(discriminator="type")]
 
 
 class ChatMessage(BaseModel):
@@ -138,6 +146,10 @@ class UsageResponse(BaseModel):
     by_model: dict[str, ModelUsage]
 
 
+class UserUsageResponse(UsageResponse):
+    user_id: str
+
+
 class UsageSummary(BaseModel):
     user_id: str
     usage: UsageResponse
@@ -1,5 +1,6 @@
 from .completions import router as completions_router
 from .admin import router as admin_router
 from .usage import router as usage_router
+from .static import router as static_router
 
-__all__ = ["completions_router", "admin_router", "usage_router"]
+__all__ = ["completions_router", "admin_router", "usage_router", "static_router"]
@@ -1,3 +1,7 @@
+import asyncio
+from dataclasses import asdict
+from datetime import datetime
+
 from fastapi import APIRouter, Depends, HTTPException
 
 from ..models.schemas import (
@@ -16,7 +20,8 @@ from ..models.schemas import (
     PricingHistoryResponse,
 )
 from ..middleware.auth import verify_admin_key
-from ..config import ALLOWED_MODELS
+from ..middleware.rate_limit import rate_limiter
+from ..config import ALLOWED_MODELS, ALLOWED_MODELS_DISPLAY
 from ..database import (
     create_user,
     get_user_by_id,
@@ -33,14 +38,52 @@ from ..database import (
     get_pricing_history,
 )
 
-router = APIRouter(prefix="/admin", tags=["admin"])
 
+def _datetime(timestamp: str | None) -> datetime | None:
+    """Parse an SQLite timestamp for a response model built with model_construct."""
+    return datetime.fromisoformat(timestamp) if timestamp else None
 
-@router.post("/users", response_model=UserResponse)
-async def create_new_user(
-    user_data: UserCreate,
-    _admin: bool = Depends(verify_admin_key),
-):
+
+def _pricing_response(pricing: dict) -> ModelPricingResponse:
+    """Build a ModelPricingResponse from a trusted model_pricing row without re-validating it."""
+    return ModelPricingResponse.model_construct(
+        model=pricing["model"],
+        input_cost_per_million=pricing["input_cost_per_million"],
+        output_cost_per_million=pricing["output_cost_per_million"],
+        created_at=_datetime(pricing["created_at"]),
+        updated_at=_datetime(pricing["updated_at"]),
+    )
+
+
+def _user_response(user) -> UserResponse:
+    """Build a UserResponse from a trusted users row without re-validating it."""
+    return UserResponse.model_construct(
+        user_id=user.id,
+        api_key=user.api_key,
+        created_at=_datetime(user.created_at),
+    )
+
+
+def _history_response(history: list[dict]) -> PricingHistoryResponse:
+    """Build a PricingHistoryResponse from trusted pricing_history rows without re-validating them."""
+    return PricingHistoryResponse.model_construct(
+        history=[
+            PricingHistoryEntry.model_construct(**{**h, "changed_at": _datetime(h["changed_at"])})
+            for h in history
+        ]
+    )
+
+
+# Every admin route requires the admin key
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(verify_admin_key)],
+)
+
+
+@router.post("/users", responses={200: {"model": UserResponse}})
+async def create_new_user(user_data: UserCreate):
     """Create a new user with an API key."""
     # Check if user already exists
     existing = await get_user_by_id(user_data.user_id)
@@ -50,107 +93,79 @@ async def create_new_user(
     try:
         user_id, api_key = await create_user(user_data.user_id)
         user = await get_user_by_id(user_id)
-        return UserResponse(
+        return UserResponse.model_construct(
             user_id=user_id,
             api_key=api_key,
-            created_at=user["created_at"] if user else None,
+            created_at=_datetime(user.created_at) if user else None,
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/users", response_model=UserListResponse)
-async def list_users(
-    _admin: bool = Depends(verify_admin_key),
-):
+@router.get("/users", responses={200: {"model": UserListResponse}})
+async def list_users():
     """List all users."""
     users = await get_all_users()
-    return UserListResponse(
-        users=[
-            UserResponse(
-                user_id=u["id"],
-                api_key=u["api_key"],
-                created_at=u["created_at"],
-            )
-            for u in users
-        ]
-    )
+    return UserListResponse.model_construct(users=[_user_response(u) for u in users])
 
 
-@router.get("/users/{user_id}", response_model=UserResponse)
-async def get_user(
-    user_id: str,
-    _admin: bool = Depends(verify_admin_key),
-):
+@router.get("/users/{user_id}", responses={200: {"model": UserResponse}})
+async def get_user(user_id: str):
     """Get a specific user."""
     user = await get_user_by_id(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    return UserResponse(
-        user_id=user["id"],
-        api_key=user["api_key"],
-        created_at=user["created_at"],
-    )
+    return _user_response(user)
 
 
 @router.delete("/users")
-async def remove_all_users(
-    _admin: bool = Depends(verify_admin_key),
-):
+async def remove_all_users():
     """Delete all users, their rate limits, and usage records."""
     count = await delete_all_users()
+    rate_limiter.reset()
     return {"message": f"Deleted {count} users and all associated data"}
 
 
 @router.delete("/users/{user_id}")
-async def remove_user(
-    user_id: str,
-    _admin: bool = Depends(verify_admin_key),
-):
+async def remove_user(user_id: str):
     """Delete a user (revoke access)."""
     success = await delete_user(user_id)
     if not success:
         raise HTTPException(status_code=404, detail="User not found")
+    rate_limiter.reset(user_id)
 
     return {"message": f"User {user_id} deleted successfully"}
 
 
-@router.get("/users/{user_id}/usage", response_model=UsageSummary)
-async def get_user_usage(
-    user_id: str,
-    _admin: bool = Depends(verify_admin_key),
-):
+@router.get("/users/{user_id}/usage", responses={200: {"model": UsageSummary}})
+async def get_user_usage(user_id: str):
     """Get usage statistics for a specific user."""
     user = await get_user_by_id(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    stats = await get_usage_stats(user_id)
-    limits = await get_rate_limits(user_id)
+    stats, limits = await asyncio.gather(get_usage_stats(user_id), get_rate_limits(user_id))
 
-    return UsageSummary(
+    return UsageSummary.model_construct(
         user_id=user_id,
-        usage=UsageResponse(
+        usage=UsageResponse.model_construct(
             total_tokens=stats["total_tokens"],
             prompt_tokens=stats["prompt_tokens"],
             completion_tokens=stats["completion_tokens"],
             total_cost=stats["total_cost"],
             request_count=stats["request_count"],
             by_model={
-                model: ModelUsage(**data)
+                model: ModelUsage.model_construct(**data)
                 for model, data in stats["by_model"].items()
             },
         ),
-        rate_limits=RateLimitResponse(user_id=user_id, **limits) if limits else None,
+        rate_limits=RateLimitResponse.model_construct(user_id=user_id, **asdict(limits)) if limits else None,
     )
 
 
-@router.get("/users/{user_id}/limits", response_model=RateLimitResponse)
-async def get_user_limits(
-    user_id: str,
-    _admin: bool = Depends(verify_admin_key),
-):
+@router.get("/users/{user_id}/limits", responses={200: {"model": RateLimitResponse}})
+async def get_user_limits(user_id: str):
     """Get rate limits for a specific user."""
     user = await get_user_by_id(user_id)
     if not user:
@@ -160,45 +175,44 @@ async def get_user_limits(
     if not limits:
         raise HTTPException(status_code=404, detail="Rate limits not found")
 
-    return RateLimitResponse(user_id=user_id, **limits)
+    return RateLimitResponse.model_construct(user_id=user_id, **asdict(limits))
 
 
-@router.put("/users/{user_id}/limits", response_model=RateLimitResponse)
+@router.put("/users/{user_id}/limits", responses={200: {"model": RateLimitResponse}})
 async def set_user_limits(
     user_id: str,
     limits: RateLimitUpdate,
-    _admin: bool = Depends(verify_admin_key),
 ):
     """Update rate limits for a specific user."""
     user = await get_user_by_id(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Update only provided fields
-    update_data = limits.model_dump(exclude_none=True)
+    # Update only the fields the client sent (an explicit null leaves a limit unchanged)
+    update_data = {
+        field: value
+        for field in limits.model_fields_set
+        if (value := getattr(limits, field)) is not None
+    }
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
 
-    success = await update_rate_limits(user_id, **update_data)
-    if not success:
+    # The new row is read back inside the same DB call
+    updated = await update_rate_limits(user_id, **update_data)
+    if not updated:
         raise HTTPException(status_code=500, detail="Failed to update rate limits")
 
-    # Return updated limits
-    updated = await get_rate_limits(user_id)
-    return RateLimitResponse(user_id=user_id, **updated)
+    return RateLimitResponse.model_construct(user_id=user_id, **asdict(updated))
 
 
 # Pricing endpoints
-@router.post("/pricing", response_model=ModelPricingResponse, status_code=201)
-async def create_model_pricing(
-    pricing: ModelPricingCreate,
-    _admin: bool = Depends(verify_admin_key),
-):
+@router.post("/pricing", status_code=201, responses={201: {"model": ModelPricingResponse}})
+async def create_model_pricing(pricing: ModelPricingCreate):
     """Set pricing for a model."""
     if pricing.model not in ALLOWED_MODELS:
         raise HTTPException(
             status_code=400,
-            detail=f"Model must be one of: {', '.join(ALLOWED_MODELS)}",
+            detail=f"Model must be one of: {', '.join(ALLOWED_MODELS_DISPLAY)}",
         )
     try:
         await set_model_pricing(
@@ -212,42 +226,34 @@ async def create_model_pricing(
         if not result:
             raise HTTPException(status_code=500, detail="Failed to retrieve pricing after creation")
 
-        return ModelPricingResponse(**result)
+        return _pricing_response(result)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/pricing", response_model=ModelPricingListResponse)
-async def list_model_pricing(
-    _admin: bool = Depends(verify_admin_key),
-):
+@router.get("/pricing", responses={200: {"model": ModelPricingListResponse}})
+async def list_model_pricing():
     """List all model pricing."""
     pricing_list = await get_all_model_pricing()
-    return ModelPricingListResponse(
-        pricing=[ModelPricingResponse(**p) for p in pricing_list]
-    )
+    return ModelPricingListResponse.model_construct(pricing=[_pricing_response(p) for p in pricing_list])
 
 
-@router.get("/pricing/{model}", response_model=ModelPricingResponse)
-async def get_pricing_for_model(
-    model: str,
-    _admin: bool = Depends(verify_admin_key),
-):
+@router.get("/pricing/{model}", responses={200: {"model": ModelPricingResponse}})
+async def get_pricing_for_model(model: str):
     """Get pricing for a specific model."""
     pricing = await get_model_pricing(model)
     if not pricing:
         raise HTTPException(status_code=404, detail=f"Pricing not found for model: {model}")
 
-    return ModelPricingResponse(**pricing)
+    return _pricing_response(pricing)
 
 
-@router.put("/pricing/{model}", response_model=ModelPricingResponse)
+@router.put("/pricing/{model}", responses={200: {"model": ModelPricingResponse}})
 async def update_model_pricing(
     model: str,
     pricing: ModelPricingCreate,
-    _admin: bool = Depends(verify_admin_key),
 ):
     """Update pricing for a specific model."""
     # Check if pricing exists
@@ -268,16 +274,13 @@ async def update_model_pricing(
         if not result:
             raise HTTPException(status_code=500, detail="Failed to retrieve pricing after update")
 
-        return ModelPricingResponse(**result)
+        return _pricing_response(result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.delete("/pricing/{model}")
-async def remove_model_pricing(
-    model: str,
-    _admin: bool = Depends(verify_admin_key),
-):
+async def remove_model_pricing(model: str):
     """Delete pricing for a model."""
     success = await delete_model_pricing(model)
     if not success:
@@ -286,24 +289,13 @@ async def remove_model_pricing(
     return {"message": f"Pricing for model {model} deleted successfully"}
 
 
-@router.get("/pricing/history/all", response_model=PricingHistoryResponse)
-async def get_all_pricing_history(
-    _admin: bool = Depends(verify_admin_key),
-):
+@router.get("/pricing/history/all", responses={200: {"model": PricingHistoryResponse}})
+async def get_all_pricing_history():
     """Get pricing change history for all models."""
-    history = await get_pricing_history()
-    return PricingHistoryResponse(
-        history=[PricingHistoryEntry(**h) for h in history]
-    )
+    return _history_response(await get_pricing_history())
 
 
-@router.get("/pricing/history/{model}", response_model=PricingHistoryResponse)
-async def get_model_pricing_history(
-    model: str,
-    _admin: bool = Depends(verify_admin_key),
-):
+@router.get("/pricing/history/{model}", responses={200: {"model": PricingHistoryResponse}})
+async def get_model_pricing_history(model: str):
     """Get pricing change history for a specific model."""
-    history = await get_pricing_history(model)
-    return PricingHistoryResponse(
-        history=[PricingHistoryEntry(**h) for h in history]
-    )
+    return _history_response(await get_pricing_history(model))
@@ -1,29 +1,150 @@
+import asyncio
 import base64
-import json
+import functools
 import logging
+import time
 
-import httpx
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, UploadFile, File, Form
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 
 logger = logging.getLogger(__name__)
 
-from ..models.schemas import ChatCompletionRequest, ChatMessage, ContentPart, ImageUrl
+from ..models.schemas import ChatCompletionRequest
 from ..services.ollama_client import ollama_client, OllamaError
-from ..services.token_tracker import token_tracker
+from ..services.token_tracker import StreamUsage, token_tracker
 from ..middleware.auth import get_current_user
 from ..middleware.rate_limit import check_rate_limit, rate_limiter
-from ..config import get_settings, ALLOWED_MODELS
+from ..config import get_settings, ALLOWED_MODELS, ALLOWED_MODELS_DISPLAY
+from ..database import UserRow
+from ..responses import ORJSONResponse
+
+settings = get_settings()
 
 router = APIRouter(prefix="/v1", tags=["completions"])
 
 PROMPT_PREVIEW_MAX_LENGTH = 200
 
+# Uploads are read and encoded in chunks; a multiple of 3 bytes encodes to
+# base64 without padding, so the encoded chunks can simply be concatenated
+UPLOAD_READ_CHUNK_SIZE = 48 * 1024
+# Files above this size are read in bigger chunks and encoded on a worker
+# thread, so encoding them does not stall other requests' streams
+UPLOAD_OFFLOAD_THRESHOLD = 256 * 1024
+UPLOAD_OFFLOAD_CHUNK_SIZE = 768 * 1024
+MAX_UPLOAD_BYTES = settings.max_upload_size_mb * 1024 * 1024
+
+# /v1/models rarely changes, so the serialized response body is cached
+MODELS_CACHE_TTL = 30.0  # seconds
+_models_cache: tuple[float, bytes] | None = None  # (monotonic fetch time, JSON body)
+_models_lock = asyncio.Lock()
+
+
+# JSON schema of the /chat/completions body and the models it references,
+# registered under components/schemas by the app's OpenAPI generator
+_chat_completion_schema = ChatCompletionRequest.model_json_schema(
+    ref_template="#/components/schemas/{model}"
+)
+CHAT_COMPLETION_SCHEMAS = {
+    **_chat_completion_schema.pop("$defs", {}),
+    "ChatCompletionRequest": _chat_completion_schema,
+}
+
+# Request body documentation for /chat/completions, whose body is parsed by
+# parse_chat_completion_request rather than a FastAPI body parameter
+_CHAT_COMPLETION_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {
+                "schema": {"$ref": "#/components/schemas/ChatCompletionRequest"},
+            },
+        },
+    },
+}
+
+
+async def parse_chat_completion_request(request: Request) -> ChatCompletionRequest:
+    """
+    Validate the raw request body straight into a ChatCompletionRequest.
+
+    model_validate_json parses and validates in one pass in pydantic-core,
+    instead of FastAPI decoding the body to Python objects with json.loads
+    and then validating those. Errors keep FastAPI's 422 shape.
+    """
+    try:
+        return ChatCompletionRequest.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
+        )
+
+
+async def _read_upload_base64(file: UploadFile) -> str:
+    """
+    Read an uploaded file and return it base64-encoded.
+
+    The file is read and encoded chunk by chunk, so the raw bytes are never
+    held in memory all at once. An oversized file is rejected with a 413
+    up front when its size is known, and otherwise as soon as it crosses the
+    limit rather than after it has been read fully.
+    """
+    too_large = HTTPException(
+        status_code=413,
+        detail=f"File {file.filename} exceeds maximum size of {settings.max_upload_size_mb}MB",
+    )
+
+    # Starlette records the size of the spooled part, so most oversized
+    # files can be rejected without reading any of them
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise too_large
+
+    # Small files stay on the event loop, where a thread hop would cost more
+    # than the encoding itself; files of unknown size are treated as large
+    offload = file.size is None or file.size > UPLOAD_OFFLOAD_THRESHOLD
+    chunk_size = UPLOAD_OFFLOAD_CHUNK_SIZE if offload else UPLOAD_READ_CHUNK_SIZE
+
+    encoded = []
+    total = 0
+    pending = b""  # bytes left over from a short read, not yet a multiple of 3
+
+    while chunk := await file.read(chunk_size):
+        total += len(chunk)
+        if total > MAX_UPLOAD_BYTES:
+            raise too_large
+        pending = pending + chunk if pending else chunk
+        cut = len(pending) - len(pending) % 3
+        if offload:
+            encoded.append(await asyncio.to_thread(base64.b64encode, pending[:cut]))
+        else:
+            encoded.append(base64.b64encode(pending[:cut]))
+        pending = pending[cut:]
+
+    encoded.append(base64.b64encode(pending))
+    return b"".join(encoded).decode("ascii")
+
+
+def _last_user_index(messages: list[dict]) -> int | None:
+    """Return the index of the last message with role "user", or None."""
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i].get("role") == "user":
+            return i
+    return None
 
-def _extract_prompt_preview(messages: list) -> str | None:
-    """Extract a truncated preview from the last user message."""
+
+def _extract_prompt_preview(messages: list, last_user_index: int | None = None) -> str | None:
+    """
+    Extract a truncated preview from the last user message.
+
+    If the caller already knows the index of the last user message, passing
+    it as last_user_index skips rescanning the messages after it.
+    """
+    start = len(messages) - 1 if last_user_index is None else last_user_index
     # Iterate in reverse to find the most recent user message
-    for msg in reversed(messages):
+    for i in range(start, -1, -1):
+        msg = messages[i]
         role = msg.role if hasattr(msg, "role") else msg.get("role")
         if role != "user":
             continue
@@ -36,13 +157,21 @@ def _extract_prompt_preview(messages: list) -> str | None:
         if isinstance(content, str):
             text = content.strip()
         elif isinstance(content, list):
-            # Multipart content (vision messages) — join text parts
+            # Multipart content (vision messages) — join text parts, but only
+            # as many as the preview can show
             text_parts = []
+            length = 0  # length of the joined parts so far, leading whitespace excluded
             for part in content:
                 part_type = part.type if hasattr(part, "type") else part.get("type")
                 if part_type == "text":
                     part_text = part.text if hasattr(part, "text") else part.get("text", "")
                     text_parts.append(part_text)
+                    length = length + 1 + len(part_text) if length else len(part_text.lstrip())
+                    # Once the text up to this part's last non-blank character
+                    # exceeds the limit, later parts cannot change the preview
+                    kept = part_text.rstrip()
+                    if kept and length - (len(part_text) - len(kept)) > PROMPT_PREVIEW_MAX_LENGTH:
+                        break
             text = " ".join(text_parts).strip() if text_parts else "[image]"
         else:
             continue
@@ -57,78 +186,80 @@ def _extract_prompt_preview(messages: list) -> str | None:
     return None
 
 
-def _check_unsupported_features(request: ChatCompletionRequest) -> list[dict]:
-    """Check for unsupported OpenAI features and return warnings."""
-    warnings = []
-
-    if request.tools:
-        warnings.append({
-            "type": "unsupported_parameter",
-            "param": "tools",
-            "message": "Tool calling is not supported by this proxy",
-        })
-
-    if request.tool_choice:
-        warnings.append({
-            "type": "unsupported_parameter",
-            "param": "tool_choice",
-            "message": "Tool choice is not supported by this proxy",
-        })
+# Warning payloads for OpenAI features the proxy ignores, built once since they never change
+_UNSUPPORTED_FEATURE_WARNINGS = (
+    ("tools", {
+        "type": "unsupported_parameter",
+        "param": "tools",
+        "message": "Tool calling is not supported by this proxy",
+    }),
+    ("tool_choice", {
+        "type": "unsupported_parameter",
+        "param": "tool_choice",
+        "message": "Tool choice is not supported by this proxy",
+    }),
+    ("logprobs", {
+        "type": "unsupported_parameter",
+        "param": "logprobs",
+        "message": "Log probabilities are not supported by this proxy",
+    }),
+    ("logit_bias", {
+        "type": "unsupported_parameter",
+        "param": "logit_bias",
+        "message": "Logit bias is not supported by this proxy",
+    }),
+)
 
-    if request.logprobs:
-        warnings.append({
-            "type": "unsupported_parameter",
-            "param": "logprobs",
-            "message": "Log probabilities are not supported by this proxy",
-        })
 
-    if request.logit_bias:
-        warnings.append({
-            "type": "unsupported_parameter",
-            "param": "logit_bias",
-            "message": "Logit bias is not supported by this proxy",
-        })
+def _check_unsupported_features(request: ChatCompletionRequest) -> list[dict]:
+    """Check for unsupported OpenAI features and return warnings."""
+    # Common case: none of them are set
+    if not (request.tools or request.tool_choice or request.logprobs or request.logit_bias):
+        return []
 
-    return warnings
+    return [warning for param, warning in _UNSUPPORTED_FEATURE_WARNINGS if getattr(request, param)]
 
 
 async def _handle_completion(
     request: ChatCompletionRequest,
     user_id: str,
+    generation: int | None,
+    last_user_index: int | None = None,
 ):
     """
     Shared completion handler for both JSON and upload endpoints.
+
+    generation is the rate limiter generation from check_rate_limit.
+    last_user_index is the position of the last user message in
+    request.messages, when the caller has already located it.
     """
     # Check for unsupported features and generate warnings
     warnings = _check_unsupported_features(request)
 
     # Extract prompt preview for request history
-    prompt_preview = _extract_prompt_preview(request.messages)
+    prompt_preview = _extract_prompt_preview(request.messages, last_user_index)
 
     if request.stream:
         # Streaming response
         async def generate():
             stream = ollama_client.chat_completion_stream(request)
+            usage = StreamUsage()
             tracked_stream = token_tracker.track_streaming_response(
                 user_id=user_id,
                 model=request.model,
                 stream=stream,
                 prompt_preview=prompt_preview,
+                usage=usage,
             )
 
-            async for chunk in tracked_stream:
-                yield chunk
-
-                # Extract tokens from final chunk for rate limiter
-                if chunk.startswith("data: ") and not chunk.startswith("data: [DONE]"):
-                    try:
-                        data = json.loads(chunk[6:])
-                        if "usage" in data and data["usage"]:
-                            total = data["usage"].get("total_tokens", 0)
-                            if total > 0:
-                                rate_limiter.record_tokens(user_id, total)
-                    except (json.JSONDecodeError, KeyError):
-                        pass
+            try:
+                async for chunk in tracked_stream:
+                    yield chunk
+            finally:
+                # The tracker only records usage for streams that report
+                # tokens, so the rate limiter counts the same requests
+                if usage.total_tokens > 0:
+                    rate_limiter.record_usage(user_id, usage.total_tokens, generation)
 
         return StreamingResponse(
             generate(),
@@ -151,59 +282,75 @@ async def _handle_completion(
             prompt_preview=prompt_preview,
         )
 
-        # Update rate limiter with token count
+        # Update rate limiter with the request and its token count
         total_tokens = response.get("usage", {}).get("total_tokens", 0)
-        if total_tokens > 0:
-            rate_limiter.record_tokens(user_id, total_tokens)
+        rate_limiter.record_usage(user_id, total_tokens, generation)
 
         # Add warnings if any
         if warnings:
             response["warnings"] = warnings
 
-        return response
+        # Already plain JSON types, so skip FastAPI's jsonable_encoder pass
+        return ORJSONResponse(response)
+
+
+def _ollama_errors(endpoint):
+    """
+    Convert errors raised by a completion endpoint into structured HTTP errors.
+
+    OllamaError keeps its status code and type; HTTPExceptions pass through;
+    anything else is logged and reported as a 500.
+    """
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await endpoint(*args, **kwargs)
+        except HTTPException:
+            raise
+        except OllamaError as e:
+            # Structured error response
+            raise HTTPException(
+                status_code=e.status_code,
+                detail={
+                    "error": {
+                        "message": e.message,
+                        "type": e.error_type,
+                        "param": e.param,
+                    }
+                },
+            )
+        except Exception:
+            logger.exception("Unexpected error in chat completion")
+            raise HTTPException(
+                status_code=500,
+                detail={
+                    "error": {
+                        "message": "Internal server error",
+                        "type": "server_error",
+                    }
+                },
+            )
+
+    return wrapper
 
 
-@router.post("/chat/completions")
+@router.post("/chat/completions", openapi_extra=_CHAT_COMPLETION_OPENAPI)
+@_ollama_errors
 async def create_chat_completion(
-    request: ChatCompletionRequest,
-    current_user: dict = Depends(get_current_user),
-    _rate_limit: None = Depends(check_rate_limit),
+    current_user: UserRow = Depends(get_current_user),
+    generation: int | None = Depends(check_rate_limit),
+    request: ChatCompletionRequest = Depends(parse_chat_completion_request),
 ):
     """
     Create a chat completion (OpenAI-compatible endpoint).
 
     Supports both streaming and non-streaming responses.
     """
-    user_id = current_user["id"]
-
-    try:
-        return await _handle_completion(request, user_id)
-    except OllamaError as e:
-        # Structured error response
-        raise HTTPException(
-            status_code=e.status_code,
-            detail={
-                "error": {
-                    "message": e.message,
-                    "type": e.error_type,
-                    "param": e.param,
-                }
-            },
-        )
-    except Exception:
-        logger.exception("Unexpected error in chat completion")
-        raise HTTPException(
-            status_code=500,
-            detail={
-                "error": {
-                    "message": "Internal server error",
-                    "type": "server_error",
-                }
-            },
-        )
+    return await _handle_completion(request, current_user.id, generation)
 
 
 @router.post("/chat/completions/upload")
+@_ollama_errors
 async def create_chat_completion_with_upload(
     model: str = Form(...),
     messages: str = Form(...),
@@ -211,8 +358,8 @@ async def create_chat_completion_with_upload(
     files: list[UploadFile] = File(default=[]),
     temperature: float | None = Form(None),
     max_tokens: int | None = Form(None),
-    current_user: dict = Depends(get_current_user),
-    _rate_limit: None = Depends(check_rate_limit),
+    current_user: UserRow = Depends(get_current_user),
+    generation: int | None = Depends(check_rate_limit),
 ):
     """
     Create a chat completion with file uploads.
@@ -220,150 +367,115 @@ async def create_chat_completion_with_upload(
     Accepts multipart form data with image files that will be converted to base64
     and injected into the last user message.
     """
-    user_id = current_user["id"]
-    settings = get_settings()
+    user_id = current_user.id
 
+    # Parse messages from JSON string
     try:
-        # Parse messages from JSON string
-        try:
-            messages_list = json.loads(messages)
-        except json.JSONDecodeError:
-            raise HTTPException(status_code=400, detail="Invalid JSON in messages field")
-
-        # Validate and convert files to base64 data URLs
-        image_contents = []
-        for file in files:
-            # Validate file type
-            if file.content_type not in settings.allowed_image_types:
-                raise HTTPException(
-                    status_code=415,
-                    detail=f"Unsupported file type: {file.content_type}. Allowed types: {', '.join(settings.allowed_image_types)}",
-                )
-
-            # Read file
-            file_data = await file.read()
-
-            # Validate file size
-            file_size_mb = len(file_data) / (1024 * 1024)
-            if file_size_mb > settings.max_upload_size_mb:
-                raise HTTPException(
-                    status_code=413,
-                    detail=f"File {file.filename} exceeds maximum size of {settings.max_upload_size_mb}MB",
-                )
-
-            # Convert to base64 data URL
-            encoded = base64.b64encode(file_data).decode("utf-8")
-            data_url = f"data:{file.content_type};base64,{encoded}"
-            image_contents.append(ImageUrl(url=data_url))
-
-        # Inject images into the last user message
-        if image_contents and messages_list:
-            # Find the last user message
-            last_user_idx = None
-            for i in range(len(messages_list) - 1, -1, -1):
-                if messages_list[i].get("role") == "user":
-                    last_user_idx = i
-                    break
-
-            if last_user_idx is not None:
-                last_msg = messages_list[last_user_idx]
-
-                # Convert content to list of parts if it's a string
-                if isinstance(last_msg.get("content"), str):
-                    text_content = last_msg["content"]
-                    content_parts = [ContentPart(type="text", text=text_content)]
-                else:
-                    content_parts = last_msg.get("content", [])
-
-                # Add image parts
-                for img in image_contents:
-                    content_parts.append(ContentPart(type="image_url", image_url=img))
-
-                messages_list[last_user_idx]["content"] = content_parts
-
-        # Build ChatCompletionRequest
-        chat_messages = []
-        for msg in messages_list:
-            chat_messages.append(ChatMessage(**msg))
-
-        request = ChatCompletionRequest(
-            model=model,
-            messages=chat_messages,
-            stream=stream,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
-
-        # Delegate to shared completion handler
-        return await _handle_completion(request, user_id)
-
-    except HTTPException:
-        raise
-    except OllamaError as e:
-        # Structured error response
-        raise HTTPException(
-            status_code=e.status_code,
-            detail={
-                "error": {
-                    "message": e.message,
-                    "type": e.error_type,
-                    "param": e.param,
-                }
-            },
-        )
-    except Exception:
-        logger.exception("Unexpected error in chat completion")
-        raise HTTPException(
-            status_code=500,
-            detail={
-                "error": {
-                    "message": "Internal server error",
-                    "type": "server_error",
-                }
-            },
-        )
-
+        messages_list = orjson.loads(messages)
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON in messages field")
+
+    # Validate and convert files to base64 data URLs
+    image_contents = []
+    for file in files:
+        # Validate file type
+        if file.content_type not in settings.allowed_image_types:
+            raise HTTPException(
+                status_code=415,
+                detail=f"Unsupported file type: {file.content_type}. Allowed types: {', '.join(settings.allowed_image_types)}",
+            )
 
-@router.get("/models")
-async def list_models(
-    current_user: dict = Depends(get_current_user),
-):
-    """List available models (proxy to Ollama)."""
-    settings = get_settings()
+        # Read and encode the file, enforcing the size limit as it streams in
+        encoded = await _read_upload_base64(file)
+        data_url = f"data:{file.content_type};base64,{encoded}"
+        image_contents.append(data_url)
+
+    # Find the last user message once; the preview reuses the index
+    last_user_idx = _last_user_index(messages_list)
+
+    # Inject images into the last user message
+    if image_contents and messages_list:
+        if last_user_idx is not None:
+            last_msg = messages_list[last_user_idx]
+
+            # Convert content to list of parts if it's a string
+            if isinstance(last_msg.get("content"), str):
+                text_content = last_msg["content"]
+                content_parts = [{"type": "text", "text": text_content}]
+            else:
+                content_parts = last_msg.get("content", [])
+
+            # Add image parts as plain dicts; validation below builds the models
+            for data_url in image_contents:
+                content_parts.append({"type": "image_url", "image_url": {"url": data_url}})
+
+            messages_list[last_user_idx]["content"] = content_parts
+
+    # Build ChatCompletionRequest, validating the messages in a single pass
+    request = ChatCompletionRequest.model_validate({
+        "model": model,
+        "messages": messages_list,
+        "stream": stream,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    })
+
+    # Delegate to shared completion handler
+    return await _handle_completion(request, user_id, generation, last_user_idx)
+
+
+async def _fetch_models() -> dict:
+    """Fetch the model list from Ollama and transform it to OpenAI format."""
+    # Reuses the shared client's connection pool
+    data = await ollama_client.list_tags()
+
+    # Transform to OpenAI format
+    models = []
+    for model in data.get("models", []):
+        name = model.get("name", "")
+        if name.endswith(":latest"):
+            name = name[:-7]
+        if name not in ALLOWED_MODELS:
+            continue
+        models.append({
+            "id": name,
+            "object": "model",
+            "created": 0,
+            "owned_by": "ollama",
+        })
 
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{settings.ollama_base_url}/api/tags")
-            response.raise_for_status()
-            data = response.json()
-
-        # Transform to OpenAI format
-        models = []
-        for model in data.get("models", []):
-            name = model.get("name", "")
-            if name.endswith(":latest"):
-                name = name[:-7]
-            if name not in ALLOWED_MODELS:
-                continue
+    # Ensure all allowed models are always present
+    present_ids = {m["id"] for m in models}
+    for allowed in ALLOWED_MODELS_DISPLAY:
+        if allowed not in present_ids:
             models.append({
-                "id": name,
+                "id": allowed,
                 "object": "model",
                 "created": 0,
                 "owned_by": "ollama",
             })
 
-        # Ensure all allowed models are always present
-        present_ids = {m["id"] for m in models}
-        for allowed in ALLOWED_MODELS:
-            if allowed not in present_ids:
-                models.append({
-                    "id": allowed,
-                    "object": "model",
-                    "created": 0,
-                    "owned_by": "ollama",
-                })
-
-        return {"object": "list", "data": models}
-
-    except Exception as e:
-        raise HTTPException(status_code=503, detail=f"Unable to fetch models: {str(e)}")
+    return {"object": "list", "data": models}
+
+
+@router.get("/models")
+async def list_models(
+    current_user: UserRow = Depends(get_current_user),
+):
+    """List available models (proxy to Ollama, cached for MODELS_CACHE_TTL seconds)."""
+    global _models_cache
+
+    if _models_cache is not None and time.monotonic() - _models_cache[0] < MODELS_CACHE_TTL:
+        return Response(_models_cache[1], media_type="application/json")
+
+    # One request refreshes the cache while concurrent callers wait for it
+    async with _models_lock:
+        if _models_cache is not None and time.monotonic() - _models_cache[0] < MODELS_CACHE_TTL:
+            return Response(_models_cache[1], media_type="application/json")
+        try:
+            models = await _fetch_models()
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Unable to fetch models: {str(e)}")
+        body = ORJSONResponse(models).body
+        _models_cache = (time.monotonic(), body)
+        return Response(body, media_type="application/json")
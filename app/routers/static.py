@@ -0,0 +1,70 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import stat
+from functools import lru_cache
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+
+from ..responses import etag_matches
+
+STATIC_DIR = os.path.realpath("static")
+
+# Files up to this size are kept in memory; larger ones are streamed from disk
+MAX_CACHED_FILE_SIZE = 64 * 1024
+
+router = APIRouter(prefix="/static", tags=["static"], include_in_schema=False)
+
+
+@lru_cache(maxsize=128)
+def _load_file(path: str, mtime_ns: int) -> tuple[bytes, str]:
+    """Read a small static file and compute its ETag.
+
+    mtime_ns is part of the cache key, so an edited file is re-read on the next
+    request while the stale entry ages out of the LRU.
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    # Weak, because the gzip and identity encodings of the file share it
+    return content, f'W/"{hashlib.md5(content).hexdigest()}"'
+
+
+def _lookup(path: str) -> tuple[str, os.stat_result, tuple[bytes, str] | None]:
+    """
+    Resolve, stat and (for small files) load a static file.
+
+    Returns (full path, stat result, (content, etag) or None for large files).
+    Raises 404 for missing files, directories and paths outside STATIC_DIR.
+    Does blocking filesystem calls, so it runs on a worker thread.
+    """
+    full_path = os.path.realpath(os.path.join(STATIC_DIR, path))
+    if not full_path.startswith(STATIC_DIR + os.sep):
+        raise HTTPException(status_code=404, detail="Not Found")
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not stat.S_ISREG(st.st_mode):
+        raise HTTPException(status_code=404, detail="Not Found")
+    if st.st_size > MAX_CACHED_FILE_SIZE:
+        return full_path, st, None
+    return full_path, st, _load_file(full_path, st.st_mtime_ns)
+
+
+@router.api_route("/{path:path}", methods=["GET", "HEAD"])
+async def static_file(path: str, request: Request):
+    """Serve a file from the static directory (the server drops the body for HEAD)."""
+    full_path, st, cached = await asyncio.to_thread(_lookup, path)
+    media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+
+    if cached is None:
+        # FileResponse handles ETag/Last-Modified and streams from disk
+        return FileResponse(full_path, media_type=media_type, stat_result=st)
+
+    content, etag = cached
+    headers = {"ETag": etag}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content, headers=headers, media_type=media_type)
@@ -1,22 +1,26 @@
-from fastapi import APIRouter, Depends, Query
+import hashlib
 
-from ..models.schemas import UsageResponse, ModelUsage
+from fastapi import APIRouter, Depends, Query, Request, Response
+
+from ..models.schemas import UserUsageResponse, ModelUsage
 from ..middleware.auth import get_current_user
 from ..services.token_tracker import token_tracker
-from ..database import get_all_model_pricing
+from ..database import UserRow, get_all_model_pricing
+from ..responses import ORJSONResponse, etag_matches
 
 router = APIRouter(prefix="/v1", tags=["usage"])
 
 
-@router.get("/usage")
+@router.get("/usage", responses={200: {"model": UserUsageResponse}})
 async def get_my_usage(
-    current_user: dict = Depends(get_current_user),
+    current_user: UserRow = Depends(get_current_user),
 ):
     """Get the current user's token usage statistics."""
-    user_id = current_user["id"]
+    user_id = current_user.id
     stats = await token_tracker.get_user_usage(user_id)
 
-    response = UsageResponse(
+    response = UserUsageResponse(
+        user_id=user_id,
         total_tokens=stats["total_tokens"],
         prompt_tokens=stats["prompt_tokens"],
         completion_tokens=stats["completion_tokens"],
@@ -27,17 +31,15 @@ async def get_my_usage(
             for model, data in stats["by_model"].items()
         },
     )
-    result = response.model_dump()
-    result["user_id"] = user_id
-    return result
+    return ORJSONResponse(response.model_dump())
 
 
 @router.get("/usage/summary")
 async def get_usage_summary(
-    current_user: dict = Depends(get_current_user),
+    current_user: UserRow = Depends(get_current_user),
 ):
     """Get a summary of the current user's usage by model."""
-    user_id = current_user["id"]
+    user_id = current_user.id
     stats = await token_tracker.get_user_usage(user_id)
 
     return {
@@ -50,17 +52,31 @@ async def get_usage_summary(
 
 @router.get("/usage/history")
 async def get_request_history(
-    current_user: dict = Depends(get_current_user),
+    request: Request,
+    current_user: UserRow = Depends(get_current_user),
     limit: int = Query(default=20, ge=1, le=100),
     offset: int = Query(default=0, ge=0),
 ):
-    """Get paginated request history for the current user."""
-    user_id = current_user["id"]
-    return await token_tracker.get_user_request_history(user_id, limit, offset)
+    """Get paginated request history for the current user.
+
+    Dashboards poll this endpoint, so it carries an ETag derived from the
+    user's latest usage id and row count, and a matching If-None-Match gets an
+    empty 304 without the page being fetched or serialized. The ETag is weak
+    because the gzip and identity encodings of the body share it.
+    """
+    user_id = current_user.id
+    latest_id, count = await token_tracker.get_user_request_history_version(user_id)
+    version = f"{user_id}:{latest_id}:{count}:{limit}:{offset}".encode()
+    etag = f'W/"{hashlib.md5(version).hexdigest()}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    history = await token_tracker.get_user_request_history(user_id, limit, offset)
+    return ORJSONResponse(history, headers={"ETag": etag})
 
 
 @router.get("/pricing")
-async def get_pricing(current_user: dict = Depends(get_current_user)):
+async def get_pricing(current_user: UserRow = Depends(get_current_user)):
     """Get current model pricing (read-only for users)."""
     pricing = await get_all_model_pricing()
     return {"pricing": pricing}
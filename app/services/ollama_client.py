@@ -1,15 +1,93 @@
 import asyncio
-import base64
+import binascii
 import httpx
-import json
 import time
-from typing import AsyncGenerator
+from contextlib import aclosing
+from typing import AsyncGenerator, AsyncIterator
+
+import orjson
 
 from ..config import get_settings
-from ..models.schemas import ChatCompletionRequest, ContentPart
+from ..models.schemas import ChatCompletionRequest, ChatMessage
 
 settings = get_settings()
 
+SSE_DONE = b"data: [DONE]\n\n"
+
+# Fetched images larger than this are base64-encoded on a worker thread
+IMAGE_ENCODE_OFFLOAD_BYTES = 256 * 1024
+
+# (ChatCompletionRequest field, Ollama option) pairs copied when set
+_OPTION_FIELDS = (
+    ("temperature", "temperature"),
+    ("max_tokens", "num_predict"),
+    ("top_p", "top_p"),
+)
+
+# Ollama lines read ahead of the one being transformed and sent
+STREAM_PREFETCH_LINES = 16
+
+
+def _sse(data: dict) -> bytes:
+    """Frame a JSON payload as a server-sent event."""
+    return b"data: " + orjson.dumps(data) + b"\n\n"
+
+
+async def _iter_ndjson(response: httpx.Response) -> AsyncGenerator[bytes, None]:
+    """
+    Yield the non-empty lines of an NDJSON response body as bytes.
+
+    Reads the raw body in large blocks and splits it on newlines in a single
+    reused buffer, instead of aiter_lines' per-chunk text decoding.
+    """
+    buf = bytearray()
+    async for data in response.aiter_bytes(65536):
+        buf += data
+        start = 0
+        while (end := buf.find(b"\n", start)) != -1:
+            if end > start:
+                yield bytes(buf[start:end])
+            start = end + 1
+        # Drop the consumed lines in place, keeping any partial trailing line
+        del buf[:start]
+    if buf.strip():
+        yield bytes(buf)
+
+
+async def _prefetch(source: AsyncIterator[bytes], maxsize: int = STREAM_PREFETCH_LINES) -> AsyncGenerator[bytes, None]:
+    """
+    Yield source's items in order while a background task reads ahead.
+
+    Up to maxsize items are buffered, so the next lines are read off the
+    socket while the current one is being transformed and sent downstream.
+    An exception raised by source is re-raised to the consumer.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize)
+
+    async def pump():
+        try:
+            async with aclosing(source):
+                async for item in source:
+                    await queue.put((item, None))
+        except Exception as e:
+            await queue.put((None, e))
+        else:
+            await queue.put((None, None))
+
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is None:
+                return
+            yield item
+    finally:
+        task.cancel()
+        # Let the reader finish unwinding before the caller closes the response
+        await asyncio.wait([task])
+
 
 class OllamaError(Exception):
     """Base exception for Ollama client errors."""
@@ -27,13 +105,23 @@ class OllamaClient:
         self.base_url = settings.ollama_base_url
         self.timeout = httpx.Timeout(120.0, connect=10.0)
         self._client: httpx.AsyncClient | None = None
-        self._semaphore: asyncio.Semaphore | None = None
+        # Limits in-flight *generations* on Ollama, not open client connections
+        self._semaphore: asyncio.BoundedSemaphore | None = None
 
     async def startup(self):
         """Initialize shared HTTP client and concurrency semaphore."""
         max_concurrent = settings.ollama_max_concurrent
-        self._semaphore = asyncio.Semaphore(max_concurrent)
-        self._client = httpx.AsyncClient(timeout=self.timeout)
+        self._semaphore = asyncio.BoundedSemaphore(max_concurrent)
+        # Keep a warm connection for every permitted upstream request (plus one
+        # for /api/tags) and hold idle ones long enough to span request gaps
+        self._client = httpx.AsyncClient(
+            timeout=self.timeout,
+            http2=settings.ollama_http2,
+            limits=httpx.Limits(
+                max_keepalive_connections=max_concurrent + 1,
+                keepalive_expiry=30.0,
+            ),
+        )
         print(f"Max concurrent Ollama requests: {max_concurrent}")
 
     async def shutdown(self):
@@ -42,35 +130,27 @@ class OllamaClient:
             await self._client.aclose()
             self._client = None
 
-    def _transform_request(self, request: ChatCompletionRequest) -> dict:
-        """Transform OpenAI-format request to Ollama format."""
-        messages = []
-        for msg in request.messages:
-            if isinstance(msg.content, str):
-                messages.append({"role": msg.role, "content": msg.content})
-            else:
-                # Handle multimodal content (vision)
-                text_parts = []
-                images = []
-
-                for part in msg.content:
-                    if isinstance(part, dict):
-                        part = ContentPart(**part)
-
-                    if part.type == "text" and part.text:
-                        text_parts.append(part.text)
-                    elif part.type == "image_url" and part.image_url:
-                        image_data = self._process_image(part.image_url.url)
-                        if image_data:
-                            images.append(image_data)
-
-                message = {
-                    "role": msg.role,
-                    "content": " ".join(text_parts) if text_parts else "",
-                }
-                if images:
-                    message["images"] = images
-                messages.append(message)
+    async def list_tags(self) -> dict:
+        """Fetch the locally available models from Ollama's /api/tags."""
+        response = await self._client.get(f"{self.base_url}/api/tags", timeout=10.0)
+        response.raise_for_status()
+        return response.json()
+
+    async def _transform_request(self, request: ChatCompletionRequest) -> dict:
+        """Transform OpenAI-format request to Ollama format, fetching any image URLs."""
+        # Plain-text conversations (the common case) map one-to-one
+        messages = [
+            {"role": msg.role, "content": msg.content}
+            for msg in request.messages
+            if isinstance(msg.content, str)
+        ]
+        if len(messages) != len(request.messages):
+            messages = [
+                {"role": msg.role, "content": msg.content}
+                if isinstance(msg.content, str)
+                else await self._transform_multimodal_message(msg)
+                for msg in request.messages
+            ]
 
         payload = {
             "model": request.model,
@@ -79,13 +159,11 @@ class OllamaClient:
         }
 
         # Add optional parameters
-        options = {}
-        if request.temperature is not None:
-            options["temperature"] = request.temperature
-        if request.max_tokens is not None:
-            options["num_predict"] = request.max_tokens
-        if request.top_p is not None:
-            options["top_p"] = request.top_p
+        options = {
+            option: value
+            for field, option in _OPTION_FIELDS
+            if (value := getattr(request, field)) is not None
+        }
         if request.stop is not None:
             if isinstance(request.stop, str):
                 options["stop"] = [request.stop]
@@ -101,28 +179,54 @@ class OllamaClient:
 
         return payload
 
-    def _process_image(self, url: str) -> str | None:
+    async def _transform_multimodal_message(self, msg: ChatMessage) -> dict:
+        """Transform a message with content parts (vision) to Ollama format."""
+        text_parts = []
+        image_fetches = []
+
+        for part in msg.content:
+            if part.type == "text" and part.text:
+                text_parts.append(part.text)
+            elif part.type == "image_url" and part.image_url:
+                image_fetches.append(self._process_image(part.image_url.url))
+
+        # Fetch the message's images concurrently, keeping their order
+        images = [image for image in await asyncio.gather(*image_fetches) if image]
+
+        message = {
+            "role": msg.role,
+            "content": " ".join(text_parts) if text_parts else "",
+        }
+        if images:
+            message["images"] = images
+        return message
+
+    async def _process_image(self, url: str) -> str | None:
         """Process image URL to base64 for Ollama."""
         if url.startswith("data:"):
             # Already base64 data URL
             # Format: data:image/jpeg;base64,/9j/4AAQ...
-            try:
-                _, data = url.split(",", 1)
-                return data
-            except ValueError:
-                return None
+            # Slice after the comma rather than split, which would also copy the header
+            comma = url.find(",")
+            return url[comma + 1:] if comma != -1 else None
         else:
             # External URL - fetch and convert to base64
             try:
-                response = httpx.get(url, timeout=30.0, follow_redirects=True)
+                response = await self._client.get(url, timeout=30.0, follow_redirects=True)
                 response.raise_for_status()
-                return base64.b64encode(response.content).decode("utf-8")
+                data = response.content
+                # Encoding a large image takes long enough to stall other streams
+                if len(data) > IMAGE_ENCODE_OFFLOAD_BYTES:
+                    encoded = await asyncio.to_thread(binascii.b2a_base64, data, newline=False)
+                else:
+                    encoded = binascii.b2a_base64(data, newline=False)
+                return encoded.decode("ascii")
             except Exception:
                 return None
 
     async def chat_completion(self, request: ChatCompletionRequest) -> dict:
         """Send a non-streaming chat completion request to Ollama."""
-        payload = self._transform_request(request)
+        payload = await self._transform_request(request)
         payload["stream"] = False
 
         try:
@@ -132,7 +236,9 @@ class OllamaClient:
                     json=payload,
                 )
                 response.raise_for_status()
-                data = response.json()
+                # Parse the body bytes directly; response.json() would first
+                # decode them into a str copy
+                data = orjson.loads(response.content)
 
             # Transform Ollama response to OpenAI format
             return self._transform_response(data, request.model)
@@ -173,13 +279,33 @@ class OllamaClient:
 
     async def chat_completion_stream(
         self, request: ChatCompletionRequest
-    ) -> AsyncGenerator[str, None]:
-        """Send a streaming chat completion request to Ollama."""
-        payload = self._transform_request(request)
+    ) -> AsyncGenerator[tuple[bytes, dict | None], None]:
+        """
+        Send a streaming chat completion request to Ollama.
+
+        Yields (sse_chunk, usage) pairs, with chunks already encoded as
+        SSE-framed bytes. usage is the token count dict on the
+        final chunk and None otherwise; it is reported even when the client
+        asked for it not to be included in the stream, so callers can track
+        usage without parsing the chunks.
+
+        The semaphore covers Ollama's generation only: it is released as soon
+        as Ollama finishes or fails, before the closing chunks are handed to a
+        possibly slow client.
+        """
+        payload = await self._transform_request(request)
         payload["stream"] = True
 
-        try:
-            async with self._semaphore:
+        # Resolved once per request rather than per streamed chunk
+        include_usage = request.stream_options.include_usage if request.stream_options else True
+        created = int(time.time())
+
+        # Chunks sent after the permit is released: the final chunk and
+        # [DONE], or an error chunk and [DONE]
+        tail: list[tuple[bytes, dict | None]] = []
+
+        async with self._semaphore:
+            try:
                 async with self._client.stream(
                     "POST",
                     f"{self.base_url}/api/chat",
@@ -211,67 +337,58 @@ class OllamaClient:
                                     "type": "server_error",
                                 }
                             }
-                        yield f"data: {json.dumps(error_chunk)}\n\n"
-                        yield "data: [DONE]\n\n"
-                        return
-
-                    try:
-                        async for line in response.aiter_lines():
-                            if not line:
-                                continue
-
-                            try:
-                                chunk_data = json.loads(line)
-                                # Check stream_options for usage inclusion
-                                include_usage = True
-                                if request.stream_options:
-                                    include_usage = request.stream_options.include_usage
-
-                                transformed = self._transform_stream_chunk(
-                                    chunk_data, request.model, include_usage
-                                )
-                                yield f"data: {json.dumps(transformed)}\n\n"
-
-                                # Check if this is the final chunk
-                                if chunk_data.get("done", False):
-                                    yield "data: [DONE]\n\n"
-                                    return
-                            except json.JSONDecodeError:
-                                continue
-
-                    except Exception as e:
-                        # Mid-stream error handling
-                        error_chunk = {
-                            "error": {
-                                "message": "Stream interrupted",
-                                "type": "server_error",
+                        tail = [(_sse(error_chunk), None), (SSE_DONE, None)]
+                    else:
+                        try:
+                            # aclosing stops the read-ahead task on every exit path,
+                            # before the response it reads from is closed
+                            async with aclosing(_prefetch(_iter_ndjson(response))) as lines:
+                                async for line in lines:
+                                    try:
+                                        chunk_data = orjson.loads(line)
+                                    except orjson.JSONDecodeError:
+                                        continue
+                                    transformed = self._transform_stream_chunk(
+                                        chunk_data, request.model, created, include_usage
+                                    )
+
+                                    # The final chunk is held back until the semaphore is released
+                                    if chunk_data.get("done", False):
+                                        tail = [
+                                            (_sse(transformed), self._usage(chunk_data)),
+                                            (SSE_DONE, None),
+                                        ]
+                                        break
+                                    yield _sse(transformed), None
+
+                        except Exception:
+                            # Mid-stream error handling
+                            error_chunk = {
+                                "error": {
+                                    "message": "Stream interrupted",
+                                    "type": "server_error",
+                                }
                             }
-                        }
-                        yield f"data: {json.dumps(error_chunk)}\n\n"
-                        yield "data: [DONE]\n\n"
-                        return
-
-        except httpx.RequestError as e:
-            # Connection error before stream starts
-            error_chunk = {
-                "error": {
-                    "message": "Unable to connect to Ollama server",
-                    "type": "server_error",
+                            tail = [(_sse(error_chunk), None), (SSE_DONE, None)]
+
+            except httpx.RequestError:
+                # Connection error before stream starts
+                error_chunk = {
+                    "error": {
+                        "message": "Unable to connect to Ollama server",
+                        "type": "server_error",
+                    }
                 }
-            }
-            yield f"data: {json.dumps(error_chunk)}\n\n"
-            yield "data: [DONE]\n\n"
-            return
+                tail = [(_sse(error_chunk), None), (SSE_DONE, None)]
+
+        for item in tail:
+            yield item
 
     def _transform_response(self, ollama_response: dict, model: str) -> dict:
         """Transform Ollama response to OpenAI format."""
 
         message = ollama_response.get("message", {})
 
-        # Calculate usage from eval_count and prompt_eval_count
-        prompt_tokens = ollama_response.get("prompt_eval_count", 0)
-        completion_tokens = ollama_response.get("eval_count", 0)
-
         return {
             "id": f"chatcmpl-{ollama_response.get('created_at', '')}",
             "object": "chat.completion",
@@ -287,15 +404,13 @@ class OllamaClient:
                     "finish_reason": "stop" if ollama_response.get("done") else None,
                 }
             ],
-            "usage": {
-                "prompt_tokens": prompt_tokens,
-                "completion_tokens": completion_tokens,
-                "total_tokens": prompt_tokens + completion_tokens,
-            },
+            "usage": self._usage(ollama_response),
         }
 
-    def _transform_stream_chunk(self, ollama_chunk: dict, model: str, include_usage: bool = True) -> dict:
-        """Transform Ollama streaming chunk to OpenAI format."""
+    def _transform_stream_chunk(
+        self, ollama_chunk: dict, model: str, created: int, include_usage: bool = True
+    ) -> dict:
+        """Transform Ollama streaming chunk to OpenAI format; created is shared by the whole stream."""
 
         message = ollama_chunk.get("message", {})
         is_done = ollama_chunk.get("done", False)
@@ -303,7 +418,7 @@ class OllamaClient:
         chunk = {
             "id": f"chatcmpl-{ollama_chunk.get('created_at', '')}",
             "object": "chat.completion.chunk",
-            "created": int(time.time()),
+            "created": created,
             "model": model,
             "choices": [
                 {
@@ -319,16 +434,21 @@ class OllamaClient:
 
         # Include usage in final chunk if requested
         if is_done and include_usage:
-            prompt_tokens = ollama_chunk.get("prompt_eval_count", 0)
-            completion_tokens = ollama_chunk.get("eval_count", 0)
-            chunk["usage"] = {
-                "prompt_tokens": prompt_tokens,
-                "completion_tokens": completion_tokens,
-                "total_tokens": prompt_tokens + completion_tokens,
-            }
+            chunk["usage"] = self._usage(ollama_chunk)
 
         return chunk
 
+    @staticmethod
+    def _usage(ollama_data: dict) -> dict:
+        """Build an OpenAI usage dict from Ollama's eval_count and prompt_eval_count."""
+        prompt_tokens = ollama_data.get("prompt_eval_count", 0)
+        completion_tokens = ollama_data.get("eval_count", 0)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
 
 # Singleton instance
 ollama_client = OllamaClient()
@@ -1,7 +1,21 @@
-import json
 from typing import AsyncGenerator
 
-from ..database import record_usage, get_usage_stats, calculate_cost, get_request_history
+from ..database import (
+    schedule_usage,
+    get_usage_stats,
+    calculate_cost,
+    get_request_history,
+    get_request_history_version,
+)
+
+
+class StreamUsage:
+    """Token usage observed in a streamed response, filled in by track_streaming_response."""
+
+    __slots__ = ("total_tokens",)
+
+    def __init__(self):
+        self.total_tokens = 0
 
 
 class TokenTracker:
@@ -16,13 +30,13 @@ class TokenTracker:
         request_id: str | None = None,
         prompt_preview: str | None = None,
     ) -> None:
-        """Record token usage for a request."""
+        """Record token usage for a request. Returns once the write is queued."""
         total_tokens = prompt_tokens + completion_tokens
 
         # Calculate cost based on model pricing
-        cost = await calculate_cost(model, prompt_tokens, completion_tokens)
+        cost = calculate_cost(model, prompt_tokens, completion_tokens)
 
-        await record_usage(
+        schedule_usage(
             user_id=user_id,
             model=model,
             prompt_tokens=prompt_tokens,
@@ -54,37 +68,35 @@ class TokenTracker:
         self,
         user_id: str,
         model: str,
-        stream: AsyncGenerator[str, None],
+        stream: AsyncGenerator[tuple[bytes, dict | None], None],
         prompt_preview: str | None = None,
-    ) -> AsyncGenerator[str, None]:
+        usage: StreamUsage | None = None,
+    ) -> AsyncGenerator[bytes, None]:
         """
         Wrap a streaming response to track usage from the final chunk.
 
-        Writes usage to the DB *before* yielding the chunk that contains it,
+        The stream yields (sse_chunk, usage) pairs, as produced by
+        OllamaClient.chat_completion_stream, so no chunk needs parsing.
+        Queues the usage write *before* yielding the chunk that carries it,
         so the write is guaranteed even if the client disconnects immediately
-        after receiving the final chunk.
+        after receiving the final chunk. If a StreamUsage is passed, its
+        total_tokens is set as well.
         """
-        tracked = False
-
-        async for chunk in stream:
-            # Extract and persist usage BEFORE yielding the chunk
-            if not tracked and chunk.startswith("data: ") and not chunk.startswith("data: [DONE]"):
-                try:
-                    data = json.loads(chunk[6:])
-                    if "usage" in data and data["usage"]:
-                        prompt_tokens = data["usage"].get("prompt_tokens", 0)
-                        completion_tokens = data["usage"].get("completion_tokens", 0)
-                        if prompt_tokens > 0 or completion_tokens > 0:
-                            await self.track_usage(
-                                user_id=user_id,
-                                model=model,
-                                prompt_tokens=prompt_tokens,
-                                completion_tokens=completion_tokens,
-                                prompt_preview=prompt_preview,
-                            )
-                            tracked = True
-                except (json.JSONDecodeError, KeyError):
-                    pass
+        async for chunk, chunk_usage in stream:
+            # Queue usage BEFORE yielding the chunk
+            if chunk_usage is not None:
+                prompt_tokens = chunk_usage["prompt_tokens"]
+                completion_tokens = chunk_usage["completion_tokens"]
+                if prompt_tokens > 0 or completion_tokens > 0:
+                    await self.track_usage(
+                        user_id=user_id,
+                        model=model,
+                        prompt_tokens=prompt_tokens,
+                        completion_tokens=completion_tokens,
+                        prompt_preview=prompt_preview,
+                    )
+                    if usage is not None:
+                        usage.total_tokens = prompt_tokens + completion_tokens
 
             yield chunk
 
@@ -96,6 +108,10 @@ class TokenTracker:
         """Get paginated request history for a user."""
         return await get_request_history(user_id, limit, offset)
 
+    async def get_user_request_history_version(self, user_id: str) -> tuple[int, int]:
+        """Get (latest usage id, row count) identifying the user's current history."""
+        return await get_request_history_version(user_id)
+
 
 # Singleton instance
 token_tracker = TokenTracker()
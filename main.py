@@ -8,23 +8,32 @@ A production-grade proxy server that sits between users and Ollama, providing:
 - Admin controls
 """
 
-import json
+import asyncio
 import uvicorn
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.openapi.utils import get_openapi
 
 from app.config import get_settings
-from app.database import init_db, close_db
-from app.middleware.auth import AuthMiddleware
-from app.middleware.request_id import RequestIdMiddleware
-from app.routers import completions_router, admin_router, usage_router
+from app.database import init_db, close_db, start_usage_writer, stop_usage_writer
+from app.middleware.compression import CompressionMiddleware
+from app.middleware.proxy import ProxyMiddleware
+from app.responses import ORJSONResponse
+from app.routers import completions_router, admin_router, usage_router, static_router
+from app.routers.completions import CHAT_COMPLETION_SCHEMAS
 from app.services.ollama_client import ollama_client
 
 settings = get_settings()
 
+# uvloop ships with uvicorn[standard] but has no Windows build, so fall back to
+# the stdlib asyncio loop where it is missing
+try:
+    import uvloop  # noqa: F401
+    EVENT_LOOP = "uvloop"
+except ImportError:
+    EVENT_LOOP = "asyncio"
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -39,30 +48,29 @@ async def lifespan(app: FastAPI):
     print()
 
     await init_db()
+    await start_usage_writer()
     await ollama_client.startup()
     print(f"Database initialized at {settings.database_path}")
+    loop_type = type(asyncio.get_running_loop())
+    print(f"Event loop: {loop_type.__module__}.{loop_type.__qualname__}")
     print(f"Forwarding requests to {settings.ollama_base_url}\n")
     print(f"Navigate to: http://localhost:{settings.port}/static/index.html")
 
     yield
 
     # Shutdown: Cleanup
+    await stop_usage_writer()
     await close_db()
     await ollama_client.shutdown()
     print("Shutting down...")
 
 
-class PrettyJSONResponse(JSONResponse):
-    def render(self, content) -> bytes:
-        return json.dumps(content, indent=2, ensure_ascii=False).encode("utf-8")
-
-
 app = FastAPI(
     title="AI Usage Proxy Server",
     description="OpenAI-compatible proxy for Ollama with usage tracking and rate limiting",
     version="1.0.0",
     lifespan=lifespan,
-    default_response_class=PrettyJSONResponse,
+    default_response_class=ORJSONResponse,
 )
 
 # Add CORS middleware
@@ -74,35 +82,70 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Add request ID middleware (before auth so request_id is available everywhere)
-app.add_middleware(RequestIdMiddleware)
+# Add request ID + authentication middleware
+app.add_middleware(ProxyMiddleware)
 
-# Add authentication middleware
-app.add_middleware(AuthMiddleware)
+# Compress larger JSON bodies (user lists, request history) for gzip clients
+app.add_middleware(CompressionMiddleware, minimum_size=512, compresslevel=5)
 
 # Include routers
 app.include_router(completions_router)
 app.include_router(usage_router)
 app.include_router(admin_router)
 
-# Mount static files for demo UI
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Static files for demo UI (small files are served from memory)
+app.include_router(static_router)
+
+
+def custom_openapi():
+    """
+    Generate the OpenAPI schema, adding the /chat/completions request models.
+
+    That route parses its body itself, so FastAPI does not know to register
+    the models its requestBody $ref points at.
+    """
+    if app.openapi_schema is None:
+        schema = get_openapi(
+            title=app.title,
+            version=app.version,
+            description=app.description,
+            routes=app.routes,
+        )
+        components = schema.setdefault("components", {}).setdefault("schemas", {})
+        for name, model_schema in CHAT_COMPLETION_SCHEMAS.items():
+            components.setdefault(name, model_schema)
+        app.openapi_schema = schema
+    return app.openapi_schema
+
+
+app.openapi = custom_openapi
+
+
+# The health responses never change, so their bodies are rendered once
+_ROOT_BODY = ORJSONResponse({
+    "status": "ok",
+    "service": "AI Usage Proxy Server",
+    "ollama_url": settings.ollama_base_url,
+}).body
+_HEALTH_BODY = ORJSONResponse({"status": "healthy"}).body
 
 
 @app.get("/")
 async def root():
     """Health check endpoint."""
-    return {
-        "status": "ok",
-        "service": "AI Usage Proxy Server",
-        "ollama_url": settings.ollama_base_url,
-    }
+    return Response(_ROOT_BODY, media_type="application/json")
 
 
 @app.get("/health")
 async def health():
     """Health check endpoint."""
-    return {"status": "healthy"}
+    return Response(_HEALTH_BODY, media_type="application/json")
+
+
+@app.head("/health", include_in_schema=False)
+async def health_head():
+    """Health check for probes that only need the status code."""
+    return Response(status_code=200)
 
 
 if __name__ == "__main__":
@@ -110,5 +153,11 @@ if __name__ == "__main__":
         "main:app",
         host=settings.host,
         port=settings.port,
-        reload=True,
+        reload=settings.reload,
+        # uvloop when installed, else asyncio (see EVENT_LOOP above)
+        loop=EVENT_LOOP,
+        # Unlike uvloop, httptools builds on every platform uvicorn[standard]
+        # supports, so it is required: a missing install fails at startup
+        # rather than quietly falling back to h11
+        http="httptools",
     )
@@ -2,35 +2,52 @@
 Mock Ollama server that responds instantly.
 Used for load testing the proxy without real LLM inference.
 """
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+import os
+
+from fastapi import FastAPI, Response
+import orjson
 import uvicorn
 
 app = FastAPI()
 
+# Responses are fixed, so they are serialized once. The proxy reports the model
+# from its own request, so the chat reply need not echo the requested model.
+_CHAT_RESPONSE = orjson.dumps({
+    "model": "llama3.2:1b",
+    "message": {"role": "assistant", "content": "Mock response."},
+    "done": True,
+    "eval_count": 5,
+    "prompt_eval_count": 10,
+})
+_TAGS_RESPONSE = orjson.dumps({
+    "models": [
+        {"name": "llama3.2:1b"},
+        {"name": "moondream:latest"},
+    ]
+})
+
 
 @app.post("/api/chat")
-async def chat(request: Request):
-    body = await request.json()
-    return JSONResponse({
-        "model": body.get("model", "llama3.2:1b"),
-        "message": {"role": "assistant", "content": "Mock response."},
-        "done": True,
-        "eval_count": 5,
-        "prompt_eval_count": 10,
-    })
+async def chat():
+    # The request body is never read
+    return Response(_CHAT_RESPONSE, media_type="application/json")
 
 
 @app.get("/api/tags")
 async def tags():
-    return {
-        "models": [
-            {"name": "llama3.2:1b"},
-            {"name": "moondream:latest"},
-        ]
-    }
+    return Response(_TAGS_RESPONSE, media_type="application/json")
 
 
 if __name__ == "__main__":
-    print("Starting mock Ollama on port 11434...")
-    uvicorn.run(app, host="0.0.0.0", port=11434)
+    # One worker per core by default, so the mock is never the bottleneck.
+    # uvicorn binds the port once and its workers share the listening socket.
+    workers = int(os.environ.get("MOCK_WORKERS", 0)) or os.cpu_count() or 1
+    print(f"Starting mock Ollama on port 11434 ({workers} workers)...")
+    uvicorn.run(
+        "mock_ollama:app",
+        host="0.0.0.0",
+        port=11434,
+        workers=workers,
+        loop="auto",  # uvloop when installed
+        http="httptools",
+    )
@@ -0,0 +1,2 @@
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: needs network access beyond the local proxy")
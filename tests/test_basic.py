@@ -4,24 +4,45 @@ Basic tests for the AI Usage Proxy Server.
 Run with: pytest tests/test_basic.py -v
 """
 
-import pytest
-from fastapi.testclient import TestClient
-from unittest.mock import AsyncMock, patch
+import asyncio
+import base64
+import os
+import uuid
 
+import httpx
+import orjson
+import pytest
+import pytest_asyncio
+from asgi_lifespan import LifespanManager
+from fastapi import HTTPException
+from unittest.mock import patch
+
+import app.database as database
+import app.responses as responses
+import app.routers.static as static_files
+from app.middleware.rate_limit import rate_limiter
+from app.models.schemas import ChatCompletionRequest
+from app.routers.completions import _read_upload_base64
+from app.services.ollama_client import ollama_client
 from main import app
 
+# Every test shares the module's event loop, the same one the app started on
+pytestmark = pytest.mark.asyncio(loop_scope="module")
 
-@pytest.fixture(scope="module")
-def client():
-    """Create a test client with proper lifespan handling."""
-    with TestClient(app) as c:
-        yield c
 
+@pytest_asyncio.fixture(scope="module", loop_scope="module")
+async def client():
+    """Create an in-process async client with proper lifespan handling."""
+    async with LifespanManager(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as c:
+            yield c
 
-@pytest.fixture(scope="module")
-def test_api_key(client):
+
+@pytest_asyncio.fixture(scope="module", loop_scope="module")
+async def test_api_key(client):
     """Create a test user via admin API and return their API key."""
-    response = client.post(
+    response = await client.post(
         "/admin/users",
         headers={"Authorization": "Bearer admin-secret-key"},
         json={"user_id": "test-user"},
@@ -30,7 +51,7 @@ def test_api_key(client):
         return response.json()["api_key"]
 
     # User already exists — find their key from the user list
-    resp = client.get(
+    resp = await client.get(
         "/admin/users",
         headers={"Authorization": "Bearer admin-secret-key"},
     )
@@ -44,44 +65,109 @@ def test_api_key(client):
 class TestHealthEndpoints:
     """Test health check endpoints."""
 
-    def test_root_endpoint(self, client):
+    async def test_root_endpoint(self, client):
         """Test the root endpoint returns status."""
-        response = client.get("/")
+        response = await client.get("/")
         assert response.status_code == 200
         data = response.json()
         assert data["status"] == "ok"
         assert "service" in data
 
-    def test_health_endpoint(self, client):
+    async def test_health_endpoint(self, client):
         """Test the health endpoint."""
-        response = client.get("/health")
+        response = await client.get("/health")
         assert response.status_code == 200
         assert response.json()["status"] == "healthy"
 
 
+class TestStaticFiles:
+    """Test the cached static file route."""
+
+    @pytest.fixture
+    def static_dir(self, tmp_path):
+        """Serve static files from a temporary directory."""
+        root = tmp_path / "static"
+        root.mkdir()
+        (tmp_path / "secret.txt").write_text("secret")
+        with patch.object(static_files, "STATIC_DIR", os.path.realpath(root)):
+            yield root
+
+    async def test_serves_file(self, client, static_dir):
+        """Test that a small file is served with its media type and an ETag."""
+        (static_dir / "app.js").write_text("console.log(1);")
+        response = await client.get("/static/app.js")
+        assert response.status_code == 200
+        assert response.text == "console.log(1);"
+        assert response.headers["content-type"].startswith("text/javascript")
+        assert response.headers["etag"]
+
+    async def test_path_traversal_rejected(self, client, static_dir):
+        """Test that paths resolving outside the static directory return 404."""
+        response = await client.get("/static/%2e%2e/secret.txt")
+        assert response.status_code == 404
+        response = await client.get("/static/missing.css")
+        assert response.status_code == 404
+
+    async def test_if_none_match_returns_304(self, client, static_dir):
+        """Test that a matching If-None-Match returns 304 without a body."""
+        (static_dir / "style.css").write_text("body {}")
+        etag = (await client.get("/static/style.css")).headers["etag"]
+
+        response = await client.get("/static/style.css", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+
+    async def test_edited_file_is_reread(self, client, static_dir):
+        """Test that a changed mtime invalidates the cached content."""
+        page = static_dir / "index.html"
+        page.write_text("old")
+        first = await client.get("/static/index.html")
+
+        page.write_text("new")
+        stat_result = page.stat()
+        os.utime(page, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 1_000_000_000))
+        second = await client.get("/static/index.html")
+
+        assert first.text == "old"
+        assert second.text == "new"
+        assert first.headers["etag"] != second.headers["etag"]
+
+    async def test_large_file_streamed_from_disk(self, client, static_dir):
+        """Test that files above the cache limit go through FileResponse."""
+        data = os.urandom(static_files.MAX_CACHED_FILE_SIZE + 1)
+        (static_dir / "large.bin").write_bytes(data)
+        misses = static_files._load_file.cache_info().misses
+
+        response = await client.get("/static/large.bin")
+        assert response.status_code == 200
+        assert response.content == data
+        assert "last-modified" in response.headers
+        assert static_files._load_file.cache_info().misses == misses
+
+
 class TestAuthentication:
     """Test authentication middleware."""
 
-    def test_missing_auth_header(self, client):
+    async def test_missing_auth_header(self, client):
         """Test that requests without auth header are rejected."""
-        response = client.post(
+        response = await client.post(
             "/v1/chat/completions",
             json={"model": "test", "messages": [{"role": "user", "content": "hi"}]},
         )
         assert response.status_code == 401
 
-    def test_invalid_auth_header_format(self, client):
+    async def test_invalid_auth_header_format(self, client):
         """Test that invalid auth header format is rejected."""
-        response = client.post(
+        response = await client.post(
             "/v1/chat/completions",
             headers={"Authorization": "Basic invalid"},
             json={"model": "test", "messages": [{"role": "user", "content": "hi"}]},
         )
         assert response.status_code == 401
 
-    def test_invalid_api_key(self, client):
+    async def test_invalid_api_key(self, client):
         """Test that invalid API key is rejected."""
-        response = client.post(
+        response = await client.post(
             "/v1/chat/completions",
             headers={"Authorization": "Bearer invalid-key"},
             json={"model": "test", "messages": [{"role": "user", "content": "hi"}]},
@@ -92,22 +178,22 @@ class TestAuthentication:
 class TestAdminEndpoints:
     """Test admin API endpoints."""
 
-    def test_admin_missing_auth(self, client):
+    async def test_admin_missing_auth(self, client):
         """Test admin endpoints require auth."""
-        response = client.get("/admin/users")
+        response = await client.get("/admin/users")
         assert response.status_code == 401
 
-    def test_admin_invalid_key(self, client):
+    async def test_admin_invalid_key(self, client):
         """Test admin endpoints reject invalid admin key."""
-        response = client.get(
+        response = await client.get(
             "/admin/users",
             headers={"Authorization": "Bearer wrong-admin-key"},
         )
         assert response.status_code == 403
 
-    def test_admin_create_user(self, client):
+    async def test_admin_create_user(self, client):
         """Test creating a user via admin API."""
-        response = client.post(
+        response = await client.post(
             "/admin/users",
             headers={"Authorization": "Bearer admin-secret-key"},
             json={"user_id": "admin-test-user"},
@@ -115,9 +201,9 @@ class TestAdminEndpoints:
         # Either 200 (created) or 409 (already exists)
         assert response.status_code in [200, 409]
 
-    def test_admin_list_users(self, client):
+    async def test_admin_list_users(self, client):
         """Test listing users via admin API."""
-        response = client.get(
+        response = await client.get(
             "/admin/users",
             headers={"Authorization": "Bearer admin-secret-key"},
         )
@@ -125,12 +211,46 @@ class TestAdminEndpoints:
         data = response.json()
         assert "users" in data
 
+    async def test_admin_update_limits_returns_new_values(self, client):
+        """Test that updating limits returns the stored row, unchanged fields included."""
+        admin_headers = {"Authorization": "Bearer admin-secret-key"}
+        user_id = f"limits-user-{uuid.uuid4().hex[:8]}"
+        await client.post("/admin/users", headers=admin_headers, json={"user_id": user_id})
+        before = (await client.get(f"/admin/users/{user_id}/limits", headers=admin_headers)).json()
+
+        response = await client.put(
+            f"/admin/users/{user_id}/limits",
+            headers=admin_headers,
+            json={"requests_per_minute": 7},
+        )
+        assert response.status_code == 200
+        assert response.json() == {**before, "requests_per_minute": 7}
+
+        await client.delete(f"/admin/users/{user_id}", headers=admin_headers)
+
+    async def test_deleted_user_key_rejected(self, client):
+        """Test that a deleted user's cached API key stops working immediately."""
+        admin_headers = {"Authorization": "Bearer admin-secret-key"}
+        await client.delete("/admin/users/deleted-user", headers=admin_headers)
+        response = await client.post(
+            "/admin/users",
+            headers=admin_headers,
+            json={"user_id": "deleted-user"},
+        )
+        api_key = response.json()["api_key"]
+        user_headers = {"Authorization": f"Bearer {api_key}"}
+
+        assert (await client.get("/v1/usage", headers=user_headers)).status_code == 200
+
+        await client.delete("/admin/users/deleted-user", headers=admin_headers)
+        assert (await client.get("/v1/usage", headers=user_headers)).status_code == 401
+
 
 class TestChatCompletions:
     """Test chat completion endpoints (mocked)."""
 
     @patch("app.services.ollama_client.ollama_client.chat_completion")
-    def test_chat_completion_non_streaming(
+    async def test_chat_completion_non_streaming(
         self, mock_completion, client, test_api_key
     ):
         """Test non-streaming chat completion."""
@@ -153,7 +273,7 @@ class TestChatCompletions:
             },
         }
 
-        response = client.post(
+        response = await client.post(
             "/v1/chat/completions",
             headers={"Authorization": f"Bearer {test_api_key}"},
             json={
@@ -167,13 +287,346 @@ class TestChatCompletions:
         assert data["choices"][0]["message"]["content"] == "Hello!"
         assert data["usage"]["total_tokens"] == 15
 
+    async def test_chat_completion_invalid_body(self, client, test_api_key):
+        """Test that an invalid request body returns a 422 with body-prefixed locations."""
+        response = await client.post(
+            "/v1/chat/completions",
+            headers={"Authorization": f"Bearer {test_api_key}"},
+            json={"model": "llama3.2:1b"},
+        )
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["loc"] == ["body", "messages"]
+
+    async def test_openapi_refs_resolve(self, client):
+        """Test that every $ref and discriminator mapping in /openapi.json resolves."""
+        spec = (await client.get("/openapi.json")).json()
+
+        def targets(node):
+            if isinstance(node, dict):
+                if isinstance(node.get("$ref"), str):
+                    yield node["$ref"]
+                mapping = node.get("discriminator", {}).get("mapping", {})
+                yield from mapping.values()
+                for value in node.values():
+                    yield from targets(value)
+            elif isinstance(node, list):
+                for item in node:
+                    yield from targets(item)
+
+        refs = set(targets(spec))
+        assert "#/components/schemas/ChatCompletionRequest" in refs
+        assert "#/components/schemas/TextPart" in refs
+        for ref in refs:
+            assert ref.startswith("#/"), ref
+            node = spec
+            for part in ref[2:].split("/"):
+                assert part in node, ref
+                node = node[part]
+
+
+class _ShortReadUpload:
+    """UploadFile stand-in that returns at most `step` bytes per read, size unknown."""
+
+    filename = "short.png"
+    size = None
+
+    def __init__(self, data: bytes, step: int):
+        self._data = data
+        self._step = step
+
+    async def read(self, size: int = -1) -> bytes:
+        chunk = self._data[:min(size, self._step)]
+        self._data = self._data[len(chunk):]
+        return chunk
+
+
+class TestUploads:
+    """Test image uploads on /v1/chat/completions/upload."""
+
+    COMPLETION = {
+        "id": "chatcmpl-upload-test",
+        "object": "chat.completion",
+        "created": 1234567890,
+        "model": "moondream",
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": "An image."},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 3, "total_tokens": 13},
+    }
+
+    async def upload(self, client, api_key, data: bytes):
+        return await client.post(
+            "/v1/chat/completions/upload",
+            headers={"Authorization": f"Bearer {api_key}"},
+            data={
+                "model": "moondream",
+                "messages": '[{"role": "user", "content": "Describe this"}]',
+            },
+            files={"files": ("image.png", data, "image/png")},
+        )
+
+    async def test_short_reads_carry_partial_groups(self):
+        """Test that bytes left over from reads not aligned to 3 are carried into the next."""
+        data = os.urandom(3 * 1000 + 2)
+        encoded = await _read_upload_base64(_ShortReadUpload(data, step=7))
+        assert encoded == base64.b64encode(data).decode("ascii")
+
+    @patch("app.routers.completions.MAX_UPLOAD_BYTES", 1024)
+    async def test_unknown_size_upload_stops_at_cap(self):
+        """Test that an upload of unknown size is rejected once it crosses the cap."""
+        with pytest.raises(HTTPException) as exc_info:
+            await _read_upload_base64(_ShortReadUpload(os.urandom(2048), step=100))
+        assert exc_info.value.status_code == 413
+
+    @patch("app.services.ollama_client.ollama_client.chat_completion")
+    async def test_large_upload_round_trips(self, mock_completion, client, test_api_key):
+        """Test that an upload encoded on a worker thread decodes to the original bytes."""
+        mock_completion.return_value = self.COMPLETION
+        data = os.urandom(300 * 1024 + 1)
+
+        response = await self.upload(client, test_api_key, data)
+        assert response.status_code == 200
+
+        request = mock_completion.call_args.args[0]
+        url = request.messages[-1].content[-1].image_url.url
+        prefix = "data:image/png;base64,"
+        assert url.startswith(prefix)
+        assert base64.b64decode(url[len(prefix):]) == data
+
+    @patch("app.routers.completions.MAX_UPLOAD_BYTES", 1024)
+    @patch("app.services.ollama_client.ollama_client.chat_completion")
+    async def test_oversized_upload_rejected(self, mock_completion, client, test_api_key):
+        """Test that an upload above the size cap returns 413 without calling Ollama."""
+        response = await self.upload(client, test_api_key, os.urandom(1025))
+        assert response.status_code == 413
+        mock_completion.assert_not_called()
+
+
+class TestUsageWriter:
+    """Test the batched usage writer and the hourly rollup it maintains."""
+
+    async def test_scheduled_rows_committed_in_one_batch(self, client):
+        """Test that rows queued together land in the usage table in one batch."""
+        user_id = f"writer-user-{uuid.uuid4().hex[:8]}"
+        with patch("app.database._write_usage_batch", wraps=database._write_usage_batch) as write:
+            for i in range(5):
+                database.schedule_usage(user_id, "llama3.2:1b", 10, i, 10 + i)
+            await database.flush_usage()
+
+        batches = [call.args[0] for call in write.call_args_list]
+        assert [len(rows) for rows in batches] == [5]
+        async with database.get_db() as db:
+            cursor = await db.execute("SELECT COUNT(*) FROM usage WHERE user_id = ?", (user_id,))
+            assert (await cursor.fetchone())[0] == 5
+
+    async def test_flush_is_a_barrier(self, client):
+        """Test that flush_usage returns only after earlier rows are readable."""
+        user_id = f"barrier-user-{uuid.uuid4().hex[:8]}"
+        database.schedule_usage(user_id, "llama3.2:1b", 7, 3, 10)
+        assert database._usage_pending > 0
+
+        await database.flush_usage()
+        assert database._usage_pending == 0
+        assert await database.get_total_tokens(user_id) == 10
+
+    async def test_rollup_matches_usage(self, client):
+        """Test that usage_rollup totals equal a SUM over the usage rows."""
+        user_id = f"rollup-user-{uuid.uuid4().hex[:8]}"
+        for tokens in (5, 12, 30):
+            database.schedule_usage(user_id, "llama3.2:1b", tokens, 0, tokens)
+        await database.flush_usage()
+        database.schedule_usage(user_id, "moondream", 8, 1, 9)
+        await database.flush_usage()
+
+        async with database.get_db() as db:
+            cursor = await db.execute(
+                "SELECT COUNT(*), SUM(total_tokens) FROM usage WHERE user_id = ?", (user_id,)
+            )
+            usage_totals = tuple(await cursor.fetchone())
+            cursor = await db.execute(
+                "SELECT SUM(requests), SUM(tokens) FROM usage_rollup WHERE user_id = ?", (user_id,)
+            )
+            rollup_totals = tuple(await cursor.fetchone())
+        assert usage_totals == rollup_totals == (4, 56)
+
+
+class TestOllamaStream:
+    """Test the streaming Ollama client against a mock upstream."""
+
+    async def test_closing_stream_stops_read_ahead(self, client):
+        """Test that closing a stream early leaves no read-ahead task running."""
+        lines = [
+            orjson.dumps({"message": {"role": "assistant", "content": str(i)}, "done": False}) + b"\n"
+            for i in range(100)
+        ]
+
+        async def body():
+            for line in lines:
+                yield line
+
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, content=body()))
+        request = ChatCompletionRequest(
+            model="llama3.2:1b",
+            messages=[{"role": "user", "content": "Count"}],
+            stream=True,
+        )
+        with patch.object(ollama_client, "_client", httpx.AsyncClient(transport=transport)):
+            stream = ollama_client.chat_completion_stream(request)
+            await anext(stream)
+            await stream.aclose()
+
+        pumps = [t for t in asyncio.all_tasks() if t.get_coro().__qualname__.endswith("pump")]
+        assert pumps == []
+        assert not ollama_client._semaphore.locked()
+
+    async def test_semaphore_released_before_final_chunk(self, client):
+        """Test that the final chunk is sent after the generation slot is freed."""
+        body = (
+            orjson.dumps({"message": {"role": "assistant", "content": "Hi"}, "done": False}) + b"\n"
+            + orjson.dumps({"done": True, "prompt_eval_count": 3, "eval_count": 1}) + b"\n"
+        )
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, content=body))
+        request = ChatCompletionRequest(
+            model="llama3.2:1b",
+            messages=[{"role": "user", "content": "Hi"}],
+            stream=True,
+        )
+        with patch.object(ollama_client, "_client", httpx.AsyncClient(transport=transport)):
+            chunks = []
+            async for chunk, usage in ollama_client.chat_completion_stream(request):
+                chunks.append((chunk, usage, ollama_client._semaphore.locked()))
+
+        assert chunks[0][2] is True
+        final_chunk, usage, locked = chunks[-2]
+        assert usage == {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4}
+        assert locked is False
+        assert chunks[-1][0] == b"data: [DONE]\n\n"
+
+
+class TestRateLimits:
+    """Test rate limit enforcement."""
+
+    @patch("app.services.ollama_client.ollama_client.chat_completion")
+    async def test_total_token_limit_enforced(self, mock_completion, client):
+        """Test that requests are rejected once the lifetime token cap is reached."""
+        admin_headers = {"Authorization": "Bearer admin-secret-key"}
+        # Usage rows outlive deleted users, so use a fresh user id per run
+        user_id = f"limited-user-{uuid.uuid4().hex[:8]}"
+        response = await client.post(
+            "/admin/users",
+            headers=admin_headers,
+            json={"user_id": user_id},
+        )
+        api_key = response.json()["api_key"]
+        await client.put(
+            f"/admin/users/{user_id}/limits",
+            headers=admin_headers,
+            json={"total_token_limit": 10},
+        )
+        mock_completion.return_value = {
+            "id": "chatcmpl-limit-test",
+            "object": "chat.completion",
+            "created": 1234567890,
+            "model": "llama3.2:1b",
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "Hi"},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": 10,
+                "completion_tokens": 5,
+                "total_tokens": 15,
+            },
+        }
+        body = {
+            "model": "llama3.2:1b",
+            "messages": [{"role": "user", "content": "Hello"}],
+        }
+        user_headers = {"Authorization": f"Bearer {api_key}"}
+
+        assert (await client.post("/v1/chat/completions", headers=user_headers, json=body)).status_code == 200
+        response = await client.post("/v1/chat/completions", headers=user_headers, json=body)
+        assert response.status_code == 429
+
+        await client.delete(f"/admin/users/{user_id}", headers=admin_headers)
+
+    @patch("app.services.ollama_client.ollama_client.chat_completion")
+    async def test_daily_limits_hydrated_after_restart(self, mock_completion, client):
+        """Test that daily usage is reloaded from the DB when in-memory counters are lost."""
+        admin_headers = {"Authorization": "Bearer admin-secret-key"}
+        user_id = f"hydrated-user-{uuid.uuid4().hex[:8]}"
+        response = await client.post("/admin/users", headers=admin_headers, json={"user_id": user_id})
+        user_headers = {"Authorization": f"Bearer {response.json()['api_key']}"}
+        await client.put(
+            f"/admin/users/{user_id}/limits",
+            headers=admin_headers,
+            json={"requests_per_day": 2, "tokens_per_day": 1000},
+        )
+        mock_completion.return_value = {
+            "id": "chatcmpl-hydrate-test",
+            "object": "chat.completion",
+            "created": 1234567890,
+            "model": "llama3.2:1b",
+            "choices": [],
+            "usage": {"prompt_tokens": 3, "completion_tokens": 4, "total_tokens": 7},
+        }
+        body = {"model": "llama3.2:1b", "messages": [{"role": "user", "content": "Hello"}]}
+
+        # A failed upstream call is admitted but records no usage, so it
+        # does not count against the daily request limit
+        mock_completion.side_effect = RuntimeError("upstream down")
+        response = await client.post("/v1/chat/completions", headers=user_headers, json=body)
+        assert response.status_code == 500
+        mock_completion.side_effect = None
+
+        for _ in range(2):
+            response = await client.post("/v1/chat/completions", headers=user_headers, json=body)
+            assert response.status_code == 200
+        counter = rate_limiter._counters[user_id]
+        before = (counter.get_daily_request_count(), counter.get_daily_token_count(), counter.total_tokens)
+        assert before == (2, 14, 14)
+
+        # Simulate a restart: the counter is rebuilt from usage_rollup
+        rate_limiter.reset()
+        response = await client.post("/v1/chat/completions", headers=user_headers, json=body)
+        assert response.status_code == 429
+        counter = rate_limiter._counters[user_id]
+        after = (counter.get_daily_request_count(), counter.get_daily_token_count(), counter.total_tokens)
+        assert after == before
+
+        await client.delete(f"/admin/users/{user_id}", headers=admin_headers)
+
+    async def test_usage_after_reset_ignored(self, client):
+        """Test that a request admitted before a reset does not record into the new counter."""
+        user_id = f"reset-user-{uuid.uuid4().hex[:8]}"
+        stale = await rate_limiter.check_rate_limit(user_id)
+        rate_limiter.reset(user_id)
+        current = await rate_limiter.check_rate_limit(user_id)
+        assert current != stale
+
+        rate_limiter.record_usage(user_id, 50, stale)
+        counter = rate_limiter._counters[user_id]
+        assert counter.total_tokens == 0
+        assert counter.get_daily_request_count() == 0
+
+        rate_limiter.record_usage(user_id, 50, current)
+        assert counter.total_tokens == 50
+        assert counter.get_daily_request_count() == 1
+
 
 class TestUsageEndpoints:
     """Test usage tracking endpoints."""
 
-    def test_get_usage(self, client, test_api_key):
+    async def test_get_usage(self, client, test_api_key):
         """Test getting user's usage."""
-        response = client.get(
+        response = await client.get(
             "/v1/usage",
             headers={"Authorization": f"Bearer {test_api_key}"},
         )
@@ -182,9 +635,9 @@ class TestUsageEndpoints:
         assert "total_tokens" in data
         assert "by_model" in data
 
-    def test_get_usage_summary(self, client, test_api_key):
+    async def test_get_usage_summary(self, client, test_api_key):
         """Test getting usage summary."""
-        response = client.get(
+        response = await client.get(
             "/v1/usage/summary",
             headers={"Authorization": f"Bearer {test_api_key}"},
         )
@@ -193,13 +646,27 @@ class TestUsageEndpoints:
         assert "total_tokens" in data
         assert "by_model" in data
 
+    @pytest.mark.parametrize("path", ["/v1/usage", "/v1/usage/summary", "/admin/users"])
+    async def test_pretty_json(self, client, test_api_key, path):
+        """PRETTY_JSON indents both explicit and default responses."""
+        key = "admin-secret-key" if path.startswith("/admin") else test_api_key
+        headers = {"Authorization": f"Bearer {key}"}
+        compact = await client.get(path, headers=headers)
+        assert not compact.content.startswith(b"{\n")
+
+        with patch.object(responses.settings, "pretty_json", True):
+            pretty = await client.get(path, headers=headers)
+        assert pretty.status_code == 200
+        assert pretty.content.startswith(b"{\n  ")
+        assert pretty.json().keys() == compact.json().keys()
+
 
 class TestRequestHistory:
     """Test request history endpoint."""
 
-    def test_get_request_history_empty(self, client, test_api_key):
+    async def test_get_request_history_empty(self, client, test_api_key):
         """Test getting request history when empty returns valid structure."""
-        response = client.get(
+        response = await client.get(
             "/v1/usage/history",
             headers={"Authorization": f"Bearer {test_api_key}"},
         )
@@ -212,9 +679,9 @@ class TestRequestHistory:
         assert "has_more" in data
         assert isinstance(data["records"], list)
 
-    def test_get_request_history_pagination_params(self, client, test_api_key):
+    async def test_get_request_history_pagination_params(self, client, test_api_key):
         """Test that limit and offset are respected."""
-        response = client.get(
+        response = await client.get(
             "/v1/usage/history?limit=5&offset=0",
             headers={"Authorization": f"Bearer {test_api_key}"},
         )
@@ -223,16 +690,82 @@ class TestRequestHistory:
         assert data["limit"] == 5
         assert data["offset"] == 0
 
-    def test_get_request_history_invalid_limit(self, client, test_api_key):
+    async def test_get_request_history_not_modified(self, client, test_api_key):
+        """Test that a matching If-None-Match returns 304 without a body."""
+        headers = {"Authorization": f"Bearer {test_api_key}"}
+        response = await client.get("/v1/usage/history", headers=headers)
+        etag = response.headers["etag"]
+
+        response = await client.get(
+            "/v1/usage/history",
+            headers={**headers, "If-None-Match": etag},
+        )
+        assert response.status_code == 304
+        assert response.content == b""
+
+    async def test_get_request_history_if_none_match_forms(self, client, test_api_key):
+        """Test tag lists, weak comparison and * in If-None-Match."""
+        headers = {"Authorization": f"Bearer {test_api_key}"}
+        etag = (await client.get("/v1/usage/history", headers=headers)).headers["etag"]
+        strong = etag.removeprefix("W/")
+
+        for value, status in [
+            (f'"other", {etag}', 304),
+            (f'W/"other",{strong}', 304),
+            ("*", 304),
+            ('W/"other", "another"', 200),
+        ]:
+            response = await client.get(
+                "/v1/usage/history",
+                headers={**headers, "If-None-Match": value},
+            )
+            assert response.status_code == status, value
+
+    @patch("app.services.ollama_client.ollama_client.chat_completion")
+    async def test_request_history_etag_changes_with_new_usage(
+        self, mock_completion, client, test_api_key
+    ):
+        """Test that the history ETag is weak and changes once a new request is recorded."""
+        mock_completion.return_value = {
+            "id": "chatcmpl-etag-test",
+            "object": "chat.completion",
+            "created": 1234567890,
+            "model": "llama3.2:1b",
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "Hi"},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {"prompt_tokens": 2, "completion_tokens": 1, "total_tokens": 3},
+        }
+        headers = {"Authorization": f"Bearer {test_api_key}"}
+        etag = (await client.get("/v1/usage/history", headers=headers)).headers["etag"]
+        assert etag.startswith('W/"')
+
+        await client.post(
+            "/v1/chat/completions",
+            headers=headers,
+            json={"model": "llama3.2:1b", "messages": [{"role": "user", "content": "Hi"}]},
+        )
+        response = await client.get(
+            "/v1/usage/history",
+            headers={**headers, "If-None-Match": etag},
+        )
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+
+    async def test_get_request_history_invalid_limit(self, client, test_api_key):
         """Test that invalid limit returns 422."""
-        response = client.get(
+        response = await client.get(
             "/v1/usage/history?limit=0",
             headers={"Authorization": f"Bearer {test_api_key}"},
         )
         assert response.status_code == 422
 
     @patch("app.services.ollama_client.ollama_client.chat_completion")
-    def test_request_history_after_completion(
+    async def test_request_history_after_completion(
         self, mock_completion, client, test_api_key
     ):
         """Test that prompt_preview appears in history after a completion."""
@@ -256,7 +789,7 @@ class TestRequestHistory:
         }
 
         # Make a completion request
-        client.post(
+        await client.post(
             "/v1/chat/completions",
             headers={"Authorization": f"Bearer {test_api_key}"},
             json={
@@ -266,7 +799,7 @@ class TestRequestHistory:
         )
 
         # Check request history
-        response = client.get(
+        response = await client.get(
             "/v1/usage/history?limit=1",
             headers={"Authorization": f"Bearer {test_api_key}"},
         )
@@ -278,6 +811,56 @@ class TestRequestHistory:
         assert latest["model"] == "llama3.2:1b"
         assert latest["total_tokens"] == 12
 
+    @patch("app.services.ollama_client.ollama_client.chat_completion")
+    async def test_cost_uses_updated_pricing(self, mock_completion, client, test_api_key):
+        """Test that cost reflects the latest pricing without a restart."""
+        admin_headers = {"Authorization": "Bearer admin-secret-key"}
+        mock_completion.return_value = {
+            "id": "chatcmpl-pricing-test",
+            "object": "chat.completion",
+            "created": 1234567890,
+            "model": "moondream",
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "Priced."},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": 10,
+                "completion_tokens": 5,
+                "total_tokens": 15,
+            },
+        }
+
+        try:
+            for input_cost in (1_000_000.0, 2_000_000.0):
+                await client.post(
+                    "/admin/pricing",
+                    headers=admin_headers,
+                    json={
+                        "model": "moondream",
+                        "input_cost_per_million": input_cost,
+                        "output_cost_per_million": 0.0,
+                    },
+                )
+                await client.post(
+                    "/v1/chat/completions",
+                    headers={"Authorization": f"Bearer {test_api_key}"},
+                    json={
+                        "model": "moondream",
+                        "messages": [{"role": "user", "content": "Price me"}],
+                    },
+                )
+                response = await client.get(
+                    "/v1/usage/history?limit=1",
+                    headers={"Authorization": f"Bearer {test_api_key}"},
+                )
+                assert response.json()["records"][0]["cost"] == input_cost / 100_000
+        finally:
+            await client.delete("/admin/pricing/moondream", headers=admin_headers)
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -4,19 +4,26 @@ Tests for vision model support.
 Run with: pytest tests/test_vision.py -v
 
 NOTE: These tests require Ollama to be running with a vision model (e.g., moondream).
+test_vision_with_url also fetches a remote image; skip it with -m "not slow".
 """
 
 import base64
+import io
 import os
+from pathlib import Path
 
 import pytest
 from openai import OpenAI
 
+# A minimal valid PNG (1x1 red pixel) as a data URI
+_RED_PIXEL_DATA_URI = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8DwHwAFBQIAX8jx0gAAAABJRU5ErkJggg=="
 
-@pytest.fixture
+
+@pytest.fixture(scope="session")
 def openai_client():
     """Create an OpenAI client pointing to our proxy.
 
+    Shared by every test, so they all reuse one pooled keep-alive connection.
     Set TEST_API_KEY env var to your user's API key.
     """
     api_key = os.environ.get("TEST_API_KEY", "sk-test-user")
@@ -26,11 +33,19 @@ def openai_client():
     )
 
 
+@pytest.fixture(scope="session")
+def small_image_data_uri():
+    """The repo's sample photo (about 6 KB) as a JPEG data URI, read once per session."""
+    photo = Path(__file__).resolve().parent.parent / "photo.jpg"
+    return "data:image/jpeg;base64," + base64.b64encode(photo.read_bytes()).decode("ascii")
+
+
 class TestVisionModel:
     """Test vision model functionality."""
 
-    def test_vision_with_url(self, openai_client):
-        """Test vision model with image URL."""
+    @pytest.mark.parametrize("stream", [False, True])
+    def test_vision(self, openai_client, small_image_data_uri, stream):
+        """Test vision model with a local photo, with and without streaming."""
         response = openai_client.chat.completions.create(
             model="moondream",
             messages=[
@@ -40,37 +55,40 @@ class TestVisionModel:
                         {"type": "text", "text": "Describe this image briefly."},
                         {
                             "type": "image_url",
-                            "image_url": {"url": "https://picsum.photos/200"},
+                            "image_url": {"url": small_image_data_uri},
                         },
                     ],
                 }
             ],
+            stream=stream,
         )
 
-        assert response.choices[0].message.content
-        print(f"Vision response: {response.choices[0].message.content}")
+        if stream:
+            buf = io.StringIO()
+            for chunk in response:
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    buf.write(delta.content)
+            content = buf.getvalue()
+        else:
+            content = response.choices[0].message.content
 
-    def test_vision_with_base64(self, openai_client):
-        """Test vision model with base64-encoded image."""
-        # Create a simple test image (1x1 red pixel PNG)
-        # This is a minimal valid PNG file
-        red_pixel_png = base64.b64decode(
-            "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8DwHwAFBQIAX8jx0gAAAABJRU5ErkJggg=="
-        )
-        base64_image = base64.b64encode(red_pixel_png).decode("utf-8")
+        assert content
+        print(f"Vision response (stream={stream}): {content}")
 
+    @pytest.mark.slow
+    def test_vision_with_url(self, openai_client):
+        """Test vision model with a remote image URL the proxy must fetch."""
         response = openai_client.chat.completions.create(
             model="moondream",
             messages=[
                 {
                     "role": "user",
                     "content": [
-                        {"type": "text", "text": "What color is this image?"},
+                        {"type": "text", "text": "Describe this image briefly."},
                         {
                             "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
-                            },
+                            "image_url": {"url": "https://picsum.photos/200"},
                         },
                     ],
                 }
@@ -78,36 +96,28 @@ class TestVisionModel:
         )
 
         assert response.choices[0].message.content
-        print(f"Vision response (base64): {response.choices[0].message.content}")
+        print(f"Vision response (URL): {response.choices[0].message.content}")
 
-    def test_vision_streaming(self, openai_client):
-        """Test vision model with streaming."""
-        collected_content = []
-
-        stream = openai_client.chat.completions.create(
+    def test_vision_with_base64(self, openai_client):
+        """Test vision model with base64-encoded image."""
+        response = openai_client.chat.completions.create(
             model="moondream",
             messages=[
                 {
                     "role": "user",
                     "content": [
-                        {"type": "text", "text": "What do you see?"},
+                        {"type": "text", "text": "What color is this image?"},
                         {
                             "type": "image_url",
-                            "image_url": {"url": "https://picsum.photos/100"},
+                            "image_url": {"url": _RED_PIXEL_DATA_URI},
                         },
                     ],
                 }
             ],
-            stream=True,
         )
 
-        for chunk in stream:
-            if chunk.choices[0].delta.content:
-                collected_content.append(chunk.choices[0].delta.content)
-
-        full_response = "".join(collected_content)
-        assert len(full_response) > 0
-        print(f"Vision streaming response: {full_response}")
+        assert response.choices[0].message.content
+        print(f"Vision response (base64): {response.choices[0].message.content}")
 
 
 if __name__ == "__main__":